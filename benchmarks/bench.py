@@ -0,0 +1,190 @@
+"""
+Benchmarks measuring the overhead added by ecflowrun to a job.
+
+Everything runs offline: the subprocess transport uses a fake
+ecflow_client that does nothing, and the relay transport talks to the
+server stand-in bundled with ecflowrun. Results are printed and can be
+saved as JSON, to be compared with the results of another version:
+
+    python benchmarks/bench.py --output new.json --compare old.json
+"""
+import os
+import sys
+import json
+import time
+import stat
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from ecflowrun import __version__
+from ecflowrun.context.manager import EcflowContextManager
+from ecflowrun.server.standin import StandinServer
+from ecflowrun.tasks import BashTask
+from ecflowrun.utils import TemporaryDirectory
+
+
+FAKE_ECFLOW_CLIENT = '#!/bin/sh\nexit 0\n'
+
+ENV = {
+    'ECF_NAME': '/bench/task',
+    'ECF_PASS': 'bench',
+    'ECF_NODE': 'localhost',
+    'ECF_PORT': '3141',
+    'ECF_TRYNO': '1',
+    'LOGGER': 'bench',
+}
+
+
+def _percentile(samples, p):
+    idx = int(round(p / 100.0 * (len(samples) - 1)))
+    return samples[idx]
+
+
+def _measure(func, iterations, warmup=3):
+    """
+    Run ``func`` several times, returning the latency statistics of a
+    single run, in milliseconds, and the number of runs per second.
+    """
+    for _ in range(warmup):
+        func()
+    samples = []
+    start = time.time()
+    for _ in range(iterations):
+        t0 = time.time()
+        func()
+        samples.append((time.time() - t0) * 1000.0)
+    elapsed = time.time() - start
+    samples.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': sum(samples) / len(samples),
+        'p50_ms': _percentile(samples, 50),
+        'p90_ms': _percentile(samples, 90),
+        'p99_ms': _percentile(samples, 99),
+        'max_ms': samples[-1],
+        'ops_per_s': iterations / elapsed,
+    }
+
+
+def _context_benchmarks(transport, iterations):
+    env = dict(ENV, transport=transport)
+    results = {}
+
+    def lifecycle():
+        with EcflowContextManager(**env):
+            pass
+
+    results['init_complete'] = _measure(lifecycle, iterations)
+
+    with EcflowContextManager(**env) as ctx:
+        results['event'] = _measure(lambda: ctx.event('e'), iterations)
+        results['label'] = _measure(lambda: ctx.label('l', 'msg'), iterations)
+        results['meter'] = _measure(lambda: ctx.meter('m', 1), iterations)
+    return results
+
+
+def run_benchmarks(iterations):
+    work_dir = tempfile.mkdtemp(prefix='ecflowrun-bench')
+    client_path = os.path.join(work_dir, 'ecflow_client')
+    with open(client_path, 'w') as fp:
+        fp.write(FAKE_ECFLOW_CLIENT)
+    os.chmod(client_path, stat.S_IRWXU)
+    os.environ['PATH'] = work_dir + os.pathsep + os.environ['PATH']
+
+    socket_path = os.path.join(work_dir, 'standin.sock')
+    os.environ['ECFLOWRUN_RELAY_SOCKET'] = socket_path
+    standin = StandinServer(socket_path).start()
+
+    results = {}
+    try:
+        for transport in ('subprocess', 'relay'):
+            for name, stats in _context_benchmarks(transport, iterations).items():
+                results['context.{0}.{1}'.format(transport, name)] = stats
+
+        env = dict(ENV, transport='relay')
+        results['bash_task.true'] = _measure(
+            lambda: BashTask('true', env).execute(), iterations
+        )
+
+        def temporary_directory():
+            with TemporaryDirectory(prefix='bench'):
+                pass
+
+        results['temporary_directory.new'] = _measure(
+            temporary_directory, iterations
+        )
+    finally:
+        standin.stop()
+        shutil.rmtree(work_dir)
+    return results
+
+
+def _print_results(results, baseline=None):
+    header = '{0:<40} {1:>10} {2:>10} {3:>10} {4:>12}'.format(
+        'benchmark', 'p50 ms', 'p90 ms', 'p99 ms', 'ops/s'
+    )
+    if baseline:
+        header += ' {0:>10}'.format('vs base')
+    print(header)
+    for name in sorted(results):
+        stats = results[name]
+        line = '{0:<40} {1:>10.3f} {2:>10.3f} {3:>10.3f} {4:>12.1f}'.format(
+            name, stats['p50_ms'], stats['p90_ms'], stats['p99_ms'],
+            stats['ops_per_s']
+        )
+        if baseline and name in baseline:
+            line += ' {0:>9.2f}x'.format(
+                stats['p50_ms'] / baseline[name]['p50_ms']
+            )
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ecflowrun benchmarks')
+    parser.add_argument(
+        '-n',
+        '--iterations',
+        help='Number of runs of each benchmark',
+        type=int,
+        default=200
+    )
+    parser.add_argument(
+        '-o',
+        '--output',
+        help='File where the results are saved as JSON'
+    )
+    parser.add_argument(
+        '-c',
+        '--compare',
+        help='JSON results of a previous run to compare with'
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.iterations)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+    _print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(
+                {
+                    'version': __version__,
+                    'python': sys.version.split()[0],
+                    'timestamp': time.time(),
+                    'results': results,
+                },
+                fp,
+                indent=2,
+                sort_keys=True
+            )
+
+
+if __name__ == '__main__':
+    main()
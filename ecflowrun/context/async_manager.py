@@ -0,0 +1,147 @@
+"""
+Asyncio flavour of the EcflowContextManager. Requires Python 3.
+"""
+import os
+import asyncio
+
+from ecflowrun.context.manager import EcflowContextManager
+
+
+class AsyncEcflowContextManager(object):
+    """
+    Asynchronous context manager with the same semantics as the
+    EcflowContextManager, to be used inside an ``async with`` statement
+    by jobs that run on an asyncio event loop.
+
+    Every child command is run on an executor, so that the event loop
+    is never blocked waiting for the Ecflow server, and the init,
+    complete, abort, event, label and meter methods return awaitables.
+    Signals are handled through the event loop instead of being
+    registered process wide, shutting the job down and exiting the
+    same way as the EcflowContextManager.
+
+    The Ecflow variables and options are the same accepted by the
+    EcflowContextManager. An explicit ``loop`` and ``executor`` can
+    also be passed. Otherwise, the loop running when the context is
+    entered is used.
+    """
+    def __init__(self, loop=None, executor=None, **kwargs):
+        kwargs['handle_signals'] = False
+        self._ctx = EcflowContextManager(**kwargs)
+        self._loop = loop
+        self._executor = executor
+        self.logger = self._ctx.logger
+
+    def __aenter__(self):
+        """
+        As we enter the managed context, we signal the Ecflow server
+        that the job as started and, once it is, register the signal
+        handlers in the event loop.
+        """
+        return self.__chain(self.init(), self.__entered)
+
+    def __entered(self, result):
+        self.__register_signals()
+        return self
+
+    def __aexit__(self, exc_type, exc_value, exc_tb):
+        """
+        As we exit the managed context, the job is either aborted or
+        completed, the same way as in the EcflowContextManager.
+        """
+        future = self.__offload(
+            self._ctx.__exit__, exc_type, exc_value, exc_tb
+        )
+        future.add_done_callback(lambda f: self.__unregister_signals())
+        return future
+
+    def __get_loop(self):
+        if self._loop is None:
+            get_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+            self._loop = get_loop()
+        return self._loop
+
+    def __offload(self, func, *args):
+        return self.__get_loop().run_in_executor(self._executor, func, *args)
+
+    def __chain(self, future, callback):
+        """
+        Return a new future resolved with the result of applying the
+        callback to the result of the given future.
+        """
+        chained = self.__get_loop().create_future()
+
+        def done(f):
+            if f.cancelled():
+                chained.cancel()
+            elif f.exception() is not None:
+                chained.set_exception(f.exception())
+            else:
+                try:
+                    chained.set_result(callback(f.result()))
+                except Exception as e:
+                    chained.set_exception(e)
+
+        future.add_done_callback(done)
+        return chained
+
+    def __signal_handler(self, signum):
+        """
+        Shut the job down if the process is signalled with the signal
+        number being registered, aborting it within the abort timeout,
+        and exit without completing it.
+        """
+        self._ctx.shutdown(signum)
+        os._exit(128 + signum)
+
+    def __register_signals(self):
+        loop = self.__get_loop()
+        for s in EcflowContextManager._TRAPPED_SIGNALS:
+            loop.add_signal_handler(s, self.__signal_handler, s)
+
+    def __unregister_signals(self):
+        for s in EcflowContextManager._TRAPPED_SIGNALS:
+            self._loop.remove_signal_handler(s)
+
+    def log(self, msg, lvl):
+        """
+        Log a message with the corresponding level.
+        """
+        self._ctx.log(msg, lvl)
+
+    def init(self):
+        """
+        Signal the Ecflow server that the job as started.
+        """
+        return self.__offload(self._ctx.__enter__)
+
+    def complete(self):
+        """
+        Signal the Ecflow server that the job is complete.
+        """
+        return self.__offload(self._ctx.__exit__, None, None, None)
+
+    def abort(self):
+        """
+        Signal the Ecflow server that the job was aborted.
+        """
+        return self.__offload(self._ctx.force_abort)
+
+    def event(self, ev):
+        """
+        Launch an Ecflow event.
+        """
+        return self.__offload(self._ctx.event, ev)
+
+    def label(self, name, msg):
+        """
+        Update the message of an Ecflow node label, identified by its
+        name.
+        """
+        return self.__offload(self._ctx.label, name, msg)
+
+    def meter(self, name, val):
+        """
+        Update the value of an Ecflow meter, identified by its name.
+        """
+        return self.__offload(self._ctx.meter, name, val)
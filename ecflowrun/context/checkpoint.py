@@ -0,0 +1,75 @@
+"""
+Checkpointing of the steps of a job, so that a retry can resume after
+the last step completed.
+"""
+import os
+
+from ecflowrun.context.transport import runtime_dir, make_private_dir
+
+
+def default_checkpoint_dir():
+    """
+    Directory where the step journals are kept, which can be changed
+    through the ECFLOWRUN_CHECKPOINT_DIR variable.
+    """
+    return os.getenv(
+        'ECFLOWRUN_CHECKPOINT_DIR', os.path.join(runtime_dir(), 'checkpoints')
+    )
+
+
+class StepJournal(object):
+    """
+    Append only journal with the names of the steps of a task that were
+    completed, one per line.
+
+    As a journal decides which steps a retry skips, its directory is
+    only accessible by the user, and checked to be so before reading it.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        make_private_dir(os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with open(self.path) as fp:
+                return set(line.rstrip('\n') for line in fp if line.endswith('\n'))
+        except IOError:
+            return set()
+
+    def record(self, name):
+        make_private_dir(os.path.dirname(os.path.abspath(self.path)))
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with os.fdopen(fd, 'a') as fp:
+            fp.write('{}\n'.format(name))
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def clear(self):
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+class Step(object):
+    """
+    Context of a single step of a job. ``done`` is true when the step
+    was already completed by a previous try of the job, in which case
+    the step should be skipped. Otherwise, the step is recorded as
+    completed when its context ends without errors.
+    """
+    def __init__(self, name, done, on_start, on_complete):
+        self.name = name
+        self.done = done
+        self._on_start = on_start
+        self._on_complete = on_complete
+
+    def __enter__(self):
+        if not self.done:
+            self._on_start(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None and not self.done:
+            self._on_complete(self)
+        return False
@@ -0,0 +1,79 @@
+"""
+Background flusher that coalesces meter and label updates before
+sending them to the Ecflow server.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+
+class CoalescingFlusher(object):
+    """
+    Buffers meter and label updates, keeping only the last value set
+    for each name, and sends them to the server from a background
+    thread at most once every ``interval`` seconds.
+
+    The ``send`` callable receives the child command and its arguments
+    and must return a tuple with output, error and return code. It is
+    called from the background thread, so it must serialize its use of
+    the transport with the other threads of the job. Failed updates,
+    including the ones raising an error, are logged and dropped, as they
+    are superseded by the next value set anyway.
+    """
+    def __init__(self, send, interval=1.0, logger=None):
+        self._send = send
+        self._interval = interval
+        self._logger = logger or logging.getLogger(__name__)
+        self._pending = OrderedDict()
+        self._pending_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def put(self, cmd, name, value):
+        """
+        Buffer a new value for the meter or label with the given name,
+        replacing any value still waiting to be sent.
+        """
+        with self._pending_lock:
+            self._pending[(cmd, name)] = value
+
+    def flush(self):
+        """
+        Send every buffered update to the server.
+        """
+        with self._send_lock:
+            with self._pending_lock:
+                pending = self._pending
+                self._pending = OrderedDict()
+            for (cmd, name), value in pending.items():
+                try:
+                    out, err, retcode = self._send(cmd, name, value)
+                except Exception as e:
+                    self._logger.warning(
+                        'Failed to send {0} {1}: {2}'.format(cmd, name, e)
+                    )
+                    continue
+                if retcode:
+                    self._logger.warning(
+                        'Failed to send {0} {1} with return code {2}'.format(
+                            cmd, name, retcode
+                        )
+                    )
+
+    def close(self):
+        """
+        Stop the background thread and send whatever is still buffered.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.flush()
@@ -0,0 +1,151 @@
+"""
+Non blocking logging for jobs, with the records written to rotating
+log files by a background thread.
+"""
+import json
+import time
+import logging
+import threading
+from logging.handlers import RotatingFileHandler
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class QueueHandler(logging.Handler):
+    """
+    Handler that only puts the records in a queue, leaving the actual
+    writing to someone else. The message is formatted right away, so
+    that the record no longer depends on its arguments.
+    """
+    def __init__(self, records):
+        logging.Handler.__init__(self)
+        self.records = records
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self.records.put_nowait(record)
+        except Exception:
+            self.handleError(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format the records as JSON documents, one per line, with the given
+    ``fields`` added to each of them.
+    """
+    def __init__(self, fields=None):
+        logging.Formatter.__init__(self)
+        self.fields = fields or {}
+
+    def format(self, record):
+        doc = dict(self.fields)
+        doc.update({
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        })
+        if record.exc_text:
+            doc['exc'] = record.exc_text
+        return json.dumps(doc, sort_keys=True)
+
+
+class _BatchedFileHandler(RotatingFileHandler):
+    """
+    Rotating file handler that leaves the flushing of the stream to the
+    caller, so that records are written in batches.
+    """
+    def flush(self):
+        pass
+
+    def sync(self):
+        self.acquire()
+        try:
+            if self.stream is not None:
+                self.stream.flush()
+        finally:
+            self.release()
+
+
+class QueuedLogWriter(object):
+    """
+    Writer of the records put in the queue of its ``handler`` to the
+    log file ``path``, rotated once it reaches ``max_bytes`` keeping
+    ``backup_count`` old files. The records are written and flushed up
+    to ``batch_size`` at a time from a background thread, as plain text
+    or, with ``json_format=True``, as JSON documents with the ``fields``
+    given.
+    """
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=5,
+                 json_format=False, fields=None, batch_size=256):
+        self.path = path
+        self.batch_size = batch_size
+        self._records = queue.Queue()
+        self.handler = QueueHandler(self._records)
+        self._file_handler = _BatchedFileHandler(
+            path, maxBytes=max_bytes, backupCount=backup_count
+        )
+        if json_format:
+            self._file_handler.setFormatter(JsonFormatter(fields))
+        else:
+            self._file_handler.setFormatter(
+                logging.Formatter('[%(asctime)s] %(levelname)s %(message)s')
+            )
+        self._thread = None
+        self._closed = False
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='ecflowrun-log-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._records.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._records.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            for record in batch:
+                if record is None:
+                    stop = True
+                else:
+                    self._file_handler.handle(record)
+            self._file_handler.sync()
+            for _ in batch:
+                self._records.task_done()
+            if stop:
+                return
+
+    def flush(self, timeout=10.0):
+        """
+        Wait, up to ``timeout`` seconds, until every record queued so
+        far is written to the log file.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        deadline = time.time() + timeout
+        while self._records.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+
+    def close(self, timeout=10.0):
+        """
+        Write the records left and stop the writer.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._records.put(None)
+            self._thread.join(timeout)
+        self._file_handler.close()
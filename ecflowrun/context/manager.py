@@ -1,14 +1,25 @@
 import os
-import subprocess
+import sys
+import json
+import time
 import traceback
-import shlex
 import signal
 import logging
+import threading
 
 from ecflowrun.errors import EcflowrunError
-
-
-logging.basicConfig(format='[%(asctime)s] %(message)s')
+from ecflowrun.context.transport import get_transport
+from ecflowrun.context.flusher import CoalescingFlusher
+from ecflowrun.context.metrics import (
+    JobMetrics, TimedTransport, total_usage, format_usage
+)
+from ecflowrun.context.retry import RetryingTransport
+from ecflowrun.context.spool import (
+    Spool, SpoolingTransport, default_spool_dir, replay_file, SPOOL_SUFFIX
+)
+from ecflowrun.context.checkpoint import StepJournal, Step, default_checkpoint_dir
+from ecflowrun.context.logs import QueuedLogWriter
+from ecflowrun.context.profiling import JobProfiler, parse_profile_modes
 
 
 class EcflowContextManager(object):
@@ -20,8 +31,9 @@ class EcflowContextManager(object):
     signal handlers.
 
     On initialization, several Ecflow variables must be passed to
-    the manager so that it updates the process environment. The
-    mandatory variables are:
+    the manager, which are used by the transport and given to the
+    child processes of the job through ``environ``, without changing
+    the process environment. The mandatory variables are:
     * ECF_NAME
     * ECF_PASS
     * ECF_NODE
@@ -29,7 +41,80 @@ class EcflowContextManager(object):
     * ECF_TRYNO
 
     Also, the manager automatically setups the variable ECF_RID to
-    the current PID.
+    the current PID or, for jobs run by a warm worker, to the PID of the
+    launcher, so that killing the launcher kills the job.
+
+    The child commands are sent to the server through a transport,
+    that can be selected with the ``transport`` keyword argument. By
+    default the in-process ecflow.Client is used when the ecflow module
+    is available, and the ecflow_client executable otherwise.
+
+    With ``buffered=True``, meter and label updates are buffered and
+    sent from a background thread at most once every ``flush_interval``
+    seconds, keeping only the last value set for each name. The buffer
+    is always flushed before the job completes or aborts.
+
+    Signal handlers are registered process wide, unless the manager is
+    created with ``handle_signals=False``. When signalled, the signal is
+    forwarded to the child processes added with ``add_child``, which are
+    killed if still running after ``shutdown_grace`` seconds, and the
+    job is aborted. The process then exits, even if the abort was not
+    delivered within ``abort_timeout`` seconds.
+
+    Several managers can be used at once from different threads, for
+    instance with the ``shared`` transport. The signal handlers are
+    installed once, from the main thread, when the first manager
+    handling signals is entered there, after its init was delivered.
+    They shut down every job running in the process whose init was
+    delivered. Processes entering the managers only from other threads
+    must call ``install_signal_handlers`` from the main thread first.
+
+    The wall and CPU time of each phase of the job (init, body and
+    complete or abort) and the latency of every child command are kept
+    in the ``metrics`` attribute. With ``report_metrics=True`` they are
+    printed as a JSON line when the job ends, and with ``metrics_file``
+    they are also written to that file for the Prometheus textfile
+    collector.
+
+    The resource usage (CPU time, maximum resident set size, block I/O
+    and context switches) of the job and of its child processes is also
+    kept in the metrics. With ``usage_label``, it is summarized in that
+    label before the job completes or aborts, and with ``usage_file``,
+    it is appended to that file as a JSON line.
+
+    The body of the job can be profiled by setting the ECFLOWRUN_PROFILE
+    variable, either as a job variable or in the environment, to ``cpu``
+    (cProfile), ``memory`` (tracemalloc) or ``all``. The results are
+    written next to the job output, ECF_JOBOUT, or else to the current
+    directory.
+
+    Jobs can be split in steps with ``step``, which are recorded in a
+    journal kept under ``checkpoint_dir`` as they complete, so that a
+    retry of the job (ECF_TRYNO above 1) can skip them. When a retry
+    resumes, the ``resume_label``, if given, is set with the name of the
+    step the job resumed from.
+
+    Failed child commands can be retried with ``retry_policies``, a
+    mapping from command type to RetryPolicy, and meter and label
+    updates can be dropped while the server is unhealthy by giving a
+    ``circuit_breaker``.
+
+    With ``spool=True``, the commands that cannot reach the server are
+    written to a spool file under ``spool_dir``, and delivered before
+    the next command is sent, or later with ``ecflow_admin replay``.
+    If ``replay_timeout`` is given, the job itself tries to replay them
+    for up to that many seconds when it ends.
+
+    By default, log messages go through the root logger, configured
+    with logging.basicConfig if nothing else configured it. With
+    ``log_file``, they are instead queued and written to that file by a
+    background thread, so that logging never blocks the job. The file is
+    rotated every ``log_max_bytes``, keeping ``log_backups`` old files,
+    and with ``log_json=True`` the messages are written as JSON lines.
+    Queued messages are written before the job completes or aborts.
+    Messages are logged through a child of the ``LOGGER`` logger named
+    after the task, so that jobs sharing a ``LOGGER`` in the same process
+    never write to each other's file.
     """
 
     # List of signals that are trapped and handled by the
@@ -59,27 +144,127 @@ class EcflowContextManager(object):
         'ECF_TRYNO'
     ])
 
+    # Managers handling signals, and the signal handlers installed
+    # before their own
+    _active_contexts = set()
+    _active_lock = threading.RLock()
+    _previous_handlers = {}
+    _signals_warned = False
+
     def __init__(self, **kwargs):
         if not self._MANDATORY_VARS.issubset(set(kwargs.keys())):
             raise EcflowrunError
 
+        transport = kwargs.pop('transport', None)
+        buffered = kwargs.pop('buffered', False)
+        flush_interval = kwargs.pop('flush_interval', 1.0)
+        handle_signals = kwargs.pop('handle_signals', True)
+        self.__shutdown_grace = kwargs.pop('shutdown_grace', 10.0)
+        self.__abort_timeout = kwargs.pop('abort_timeout', 30.0)
+        self.__report_metrics = kwargs.pop('report_metrics', False)
+        self.__metrics_file = kwargs.pop('metrics_file', None)
+        self.__usage_label = kwargs.pop('usage_label', None)
+        self.__usage_file = kwargs.pop('usage_file', None)
+        self.__checkpoint_dir = kwargs.pop('checkpoint_dir', None)
+        self.__resume_label = kwargs.pop('resume_label', None)
+        retry_policies = kwargs.pop('retry_policies', None)
+        circuit_breaker = kwargs.pop('circuit_breaker', None)
+        spool = kwargs.pop('spool', False)
+        spool_dir = kwargs.pop('spool_dir', None)
+        self.__replay_timeout = kwargs.pop('replay_timeout', 0)
+        log_file = kwargs.pop('log_file', None)
+        log_json = kwargs.pop('log_json', False)
+        log_max_bytes = kwargs.pop('log_max_bytes', 10 * 1024 * 1024)
+        log_backups = kwargs.pop('log_backups', 5)
+
         self.__env = {}
-        for k, v in kwargs.iteritems():
+        for k, v in kwargs.items():
             self.__env[k] = v
-        self.__env['ECF_RID'] = str(os.getpid())
-        os.environ.update(self.__env)
-        self.__register_signals()
+        self.__env['ECF_RID'] = os.getenv('ECFLOWRUN_LAUNCHER_PID', str(os.getpid()))
+        self.metrics = JobMetrics(self.__env['ECF_NAME'], self.__env['ECF_TRYNO'])
+        self.__profiler = None
+        profile_modes = parse_profile_modes(
+            self.__env.get('ECFLOWRUN_PROFILE', os.getenv('ECFLOWRUN_PROFILE'))
+        )
+        transport = get_transport(self.__env, transport)
+        if retry_policies or circuit_breaker:
+            transport = RetryingTransport(
+                transport, retry_policies, circuit_breaker
+            )
+        self.__spool = None
+        if spool:
+            self.__spool = Spool(os.path.join(
+                spool_dir or default_spool_dir(),
+                '{0:.6f}-{1}-{2:x}{3}'.format(
+                    time.time(), os.getpid(), id(self), SPOOL_SUFFIX
+                )
+            ))
+            transport = SpoolingTransport(transport, self.__spool, self.__env)
+        self.__transport = TimedTransport(transport, self.metrics)
+        self.__cmd_lock = threading.Lock()
+        self.__children = set()
+        self.__children_lock = threading.Lock()
+        self.__shutting_down = False
 
-        # Setup a basic logger
-        self.logger = logging.getLogger(kwargs.pop('LOGGER'))
+        # Setup the logger of the job, either through a queue of its own
+        # or through the root logger
+        self.logger = logging.getLogger('{0}.{1}'.format(
+            kwargs.pop('LOGGER'),
+            str(self.__env['ECF_NAME']).strip('/').replace('/', '.')
+        ))
         self.logger.setLevel(logging.INFO)
+        self.__log_writer = None
+        if log_file is not None:
+            self.__log_writer = QueuedLogWriter(
+                log_file,
+                max_bytes=log_max_bytes,
+                backup_count=log_backups,
+                json_format=log_json,
+                fields={
+                    'task': self.__env['ECF_NAME'],
+                    'tryno': self.__env['ECF_TRYNO'],
+                }
+            )
+            self.__log_writer.start()
+            self.logger.addHandler(self.__log_writer.handler)
+            self.logger.propagate = False
+        else:
+            logging.basicConfig(format='[%(asctime)s] %(message)s')
+
+        self.__journal = None
+        self.__completed_steps = set()
+        self.__skipped_steps = []
+        self.__resumed = False
+
+        self.__flusher = None
+        if buffered:
+            self.__flusher = CoalescingFlusher(
+                self.__run_cmd, flush_interval, self.logger
+            )
+
+        if profile_modes:
+            self.__profiler = JobProfiler(
+                profile_modes, self.__profile_prefix(), logger=self.logger
+            )
+
+        self.__handle_signals = handle_signals
 
     def __enter__(self):
         """
         As we enter the managed context, we signal the Ecflow server
-        that the job as started.
+        that the job as started. Only then is the job shut down when the
+        process is signalled.
         """
-        self.__job_init()
+        self.metrics.usage.start()
+        with self.metrics.phase('init'):
+            self.__job_init()
+        if self.__handle_signals:
+            self.__register_signals()
+        if self.__profiler is not None:
+            self.__profiler.start()
+        self.metrics.start('body')
+        if self.__flusher is not None:
+            self.__flusher.start()
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
@@ -89,36 +274,154 @@ class EcflowContextManager(object):
         error was detected. Otherwise, we just signal that the job as
         completed.
         """
-        if exc_type:
-            print traceback.format_exception(exc_type, exc_value, exc_tb)
-            self.__job_abort()
-            return False
-        self.__job_complete()
-        return True
-
-    def __run_cmd(self, cmd):
-        """
-        Generic way of sending commands to the ecflow_client. Probably
-        best to investigate if this can be done using the ecflow.Client
-        instead of an indirect call through a child process.
-        """
-        raw_cmd = 'ecflow_client --{}'.format(cmd)
-        splitted = shlex.split(raw_cmd)
-        process = subprocess.Popen(
-            splitted,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
+        self.metrics.stop('body')
+        self.__stop_profiler()
+        self.metrics.usage.stop()
+        self.__publish_usage()
+        try:
+            if exc_type:
+                print(traceback.format_exception(exc_type, exc_value, exc_tb))
+                with self.metrics.phase('abort'):
+                    self.__job_abort()
+                return False
+            with self.metrics.phase('complete'):
+                self.__job_complete()
+            return True
+        finally:
+            self.__transport.close()
+            self.__replay_spool()
+            self.__emit_metrics()
+            self.__close_log_writer()
+            self.__unregister_signals()
+
+    def __run_cmd(self, cmd, *args):
+        """
+        Generic way of sending child commands to the Ecflow server,
+        through the transport selected for this job, one at a time.
+        """
+        if self.__shutting_down:
+            # The lock may be held by the thread interrupted by the
+            # signal, so the abort must not wait for it
+            return self.__transport.send(cmd, *args)
+        with self.__cmd_lock:
+            return self.__transport.send(cmd, *args)
+
+    def __replay_spool(self):
+        """
+        Try to deliver the commands spooled by the job, if any, for up
+        to the replay timeout.
+        """
+        if self.__spool is None or self.__spool.empty:
+            return
+        if self.__replay_timeout and replay_file(
+            self.__spool.path, time.time() + self.__replay_timeout
+        ):
+            self.log('Spooled commands delivered', logging.INFO)
+        else:
+            self.log(
+                'Spooled commands left in {}'.format(self.__spool.path),
+                logging.WARNING
+            )
+
+    def __emit_metrics(self):
+        """
+        Report the metrics of the job, if requested.
+        """
+        if self.__report_metrics:
+            sys.stdout.write(self.metrics.to_json() + '\n')
+            sys.stdout.flush()
+        if self.__metrics_file is not None:
+            try:
+                self.metrics.write_prometheus(self.__metrics_file)
+            except (IOError, OSError) as e:
+                self.logger.warning(
+                    'Failed to write metrics to {0}: {1}'.format(
+                        self.__metrics_file, e
+                    )
+                )
+
+    def __profile_prefix(self):
+        """
+        Path, without extension, of the profiling results of the job.
+        """
+        if 'ECF_JOBOUT' in self.__env:
+            return str(self.__env['ECF_JOBOUT'])
+        name = '{0}.{1}'.format(
+            str(self.__env['ECF_NAME']).strip('/').replace('/', '.'),
+            self.__env['ECF_TRYNO']
         )
-        out, err = process.communicate()
-        retcode = process.returncode
-        return out, err, retcode
+        return os.path.join(os.getcwd(), name)
+
+    def __stop_profiler(self):
+        if self.__profiler is None:
+            return
+        try:
+            for path in self.__profiler.stop():
+                self.log('Profile written to {}'.format(path), logging.INFO)
+        except (IOError, OSError) as e:
+            self.logger.warning('Failed to write profile: {}'.format(e))
+
+    def __publish_usage(self):
+        """
+        Set the usage label and append the resource usage to the usage
+        file, if requested.
+        """
+        usage = self.metrics.usage.usage
+        if not usage:
+            return
+        if self.__usage_label is not None:
+            try:
+                self.label(self.__usage_label, format_usage(total_usage(usage)))
+            except EcflowrunError as e:
+                self.logger.warning('Failed to set usage label: {}'.format(e))
+        if self.__usage_file is not None:
+            record = {
+                'task': self.__env['ECF_NAME'],
+                'tryno': self.__env['ECF_TRYNO'],
+                'time': time.time(),
+                'usage': usage,
+            }
+            try:
+                with open(self.__usage_file, 'a') as fp:
+                    fp.write(json.dumps(record, sort_keys=True) + '\n')
+            except (IOError, OSError) as e:
+                self.logger.warning(
+                    'Failed to write usage to {0}: {1}'.format(self.__usage_file, e)
+                )
+
+    def __close_flusher(self):
+        """
+        Send any buffered meter and label updates and stop buffering
+        new ones.
+        """
+        if self.__flusher is not None:
+            flusher = self.__flusher
+            self.__flusher = None
+            flusher.close()
+
+    def __flush_logs(self):
+        """
+        Write any queued log messages.
+        """
+        if self.__log_writer is not None:
+            self.__log_writer.flush()
+
+    def __close_log_writer(self):
+        """
+        Stop queueing log messages, writing the ones left.
+        """
+        if self.__log_writer is not None:
+            self.logger.removeHandler(self.__log_writer.handler)
+            self.logger.propagate = True
+            self.__log_writer.close()
+            self.__log_writer = None
 
     def __job_init(self):
         """
         Signal the Ecflow server that the job as started.
         """
         out, err, retcode = self.__run_cmd(
-            'init={}'.format(self.__env['ECF_RID'])
+            'init', self.__env['ECF_RID']
         )
         if retcode:
             raise EcflowrunError(
@@ -129,38 +432,175 @@ class EcflowContextManager(object):
         """
         Signal the Ecflow server that the job is complete.
         """
+        self.__close_flusher()
+        self.__flush_logs()
         out, err, retcode = self.__run_cmd('complete')
         if retcode:
             raise EcflowrunError(
                 'Complete failed with return code {}'.format(retcode)
             )
+        if self.__journal is not None:
+            self.__journal.clear()
 
     def __job_abort(self):
         """
         Signal the Ecflow server that the job was aborted.
         """
+        self.__close_flusher()
+        self.__flush_logs()
         out, err, retcode = self.__run_cmd(
-            'abort={}'.format(self.__env['ECF_RID'])
+            'abort', self.__env['ECF_RID']
         )
         if retcode:
             raise EcflowrunError(
                 'Abort failed with return code {}'.format(retcode)
             )
 
-    def __signal_handler(self, signum, stframe):
+    def __open_journal(self):
+        """
+        Open the step journal of the task, starting a new one unless
+        this is a retry of the job.
+        """
+        name = '{0}_{1}{2}.steps'.format(
+            self.__env['ECF_NODE'], self.__env['ECF_PORT'], self.__env['ECF_NAME']
+        ).replace('/', '.')
+        self.__journal = StepJournal(
+            os.path.join(self.__checkpoint_dir or default_checkpoint_dir(), name)
+        )
+        try:
+            tryno = int(self.__env['ECF_TRYNO'])
+        except ValueError:
+            tryno = 1
+        if tryno <= 1:
+            self.__journal.clear()
+        self.__completed_steps = self.__journal.load()
+
+    def __start_step(self, step):
+        if self.__skipped_steps and not self.__resumed:
+            self.__resumed = True
+            msg = 'resumed from step {0} on try {1}'.format(
+                step.name, self.__env['ECF_TRYNO']
+            )
+            self.log('Job {}'.format(msg), logging.INFO)
+            if self.__resume_label is not None:
+                self.label(self.__resume_label, msg)
+
+    def __complete_step(self, step):
+        self.__journal.record(step.name)
+        self.__completed_steps.add(step.name)
+
+    @classmethod
+    def __signal_handler(cls, signum, stframe):
+        """
+        Shut down every job of the process if the process is signalled
+        with the signal number being registered, and exit. Without jobs
+        running, the signal is handled as it was before the handlers
+        were installed.
+        """
+        with cls._active_lock:
+            contexts = list(cls._active_contexts)
+        if not contexts:
+            previous = cls._previous_handlers.get(signum)
+            if callable(previous):
+                return previous(signum, stframe)
+            if previous != signal.SIG_IGN:
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+            return
+        threads = []
+        for ctx in contexts:
+            t = threading.Thread(target=ctx.__shutdown, args=(signum,))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        os._exit(128 + signum)
+
+    def __shutdown(self, signum):
+        """
+        Shut the job down. The abort is sent from another thread while
+        the child processes are stopped, waiting for both up to the
+        abort timeout.
+        """
+        if self.__shutting_down:
+            return
+        self.__shutting_down = True
+        deadline = time.time() + self.__abort_timeout
+        self.log('Received signal {}, shutting down'.format(signum), logging.WARNING)
+
+        def abort():
+            try:
+                with self.metrics.phase('abort'):
+                    self.__job_abort()
+            except Exception as e:
+                self.log('Failed to abort job: {}'.format(e), logging.ERROR)
+
+        aborter = threading.Thread(target=abort)
+        aborter.daemon = True
+        aborter.start()
+        self.__stop_children(signum)
+        aborter.join(max(0, deadline - time.time()))
+        if aborter.is_alive():
+            self.log(
+                'Abort not delivered within {}s'.format(self.__abort_timeout),
+                logging.ERROR
+            )
+        if self.__log_writer is not None:
+            self.__log_writer.flush(1.0)
+
+    def __stop_children(self, signum):
+        """
+        Forward a signal to the child processes, killing the ones still
+        running after the grace period.
+        """
+        with self.__children_lock:
+            children = list(self.__children)
+        for child in children:
+            child.send_signal(signum)
+        deadline = time.time() + self.__shutdown_grace
+        for child in children:
+            while child.running() and time.time() < deadline:
+                time.sleep(0.05)
+            if child.running():
+                child.kill()
+
+    @classmethod
+    def install_signal_handlers(cls):
         """
-        Abort the job if the process is signalled with the
-        signal number being registered.
+        Register the generic signal handler for all signals that we
+        can catch. This must be done from the main thread, and is done
+        when the first manager handling signals is entered there, once
+        its init was delivered.
         """
-        self.__job_abort()
+        with cls._active_lock:
+            if cls._previous_handlers:
+                return
+            for s in cls._TRAPPED_SIGNALS:
+                cls._previous_handlers[s] = signal.signal(s, cls.__signal_handler)
 
     def __register_signals(self):
         """
-        Register the generic signal handler for all signals
-        that we can catch.
+        Add the job to the ones shut down when the process is signalled.
         """
-        for s in self._TRAPPED_SIGNALS:
-            signal.signal(s, self.__signal_handler)
+        try:
+            self.install_signal_handlers()
+        except ValueError:
+            with self._active_lock:
+                warn = not EcflowContextManager._signals_warned
+                EcflowContextManager._signals_warned = True
+            if warn:
+                self.log(
+                    'Signal handlers can only be installed from the main thread',
+                    logging.WARNING
+                )
+        with self._active_lock:
+            self._active_contexts.add(self)
+
+    def __unregister_signals(self):
+        if self.__handle_signals:
+            with self._active_lock:
+                self._active_contexts.discard(self)
 
     def log(self, msg, lvl):
         """
@@ -168,6 +608,37 @@ class EcflowContextManager(object):
         """
         self.logger.log(lvl, msg)
 
+    def environ(self):
+        """
+        Return the environment for the child processes of the job, with
+        the variables of the job added to the process environment.
+        """
+        env = dict(os.environ)
+        for k, v in self.__env.items():
+            env[k] = str(v)
+        return env
+
+    def add_child(self, process):
+        """
+        Add a child process, with the StreamingProcess interface, to be
+        signalled and stopped if the job is signalled.
+        """
+        with self.__children_lock:
+            self.__children.add(process)
+        return process
+
+    def remove_child(self, process):
+        with self.__children_lock:
+            self.__children.discard(process)
+
+    def shutdown(self, signum):
+        """
+        Shut the job down as when the process is signalled, without
+        exiting. Meant for managers created with ``handle_signals=False``
+        whose signals are handled elsewhere.
+        """
+        self.__shutdown(signum)
+
     def force_abort(self):
         """
         Allows a job to abort itself.
@@ -178,7 +649,7 @@ class EcflowContextManager(object):
         """
         Use the ecflow client to launch an Ecflow event.
         """
-        out, err, retcode = self.__run_cmd('event={}'.format(ev))
+        out, err, retcode = self.__run_cmd('event', ev)
         if retcode:
             raise EcflowrunError(
                 'Failed to raise event with return code {}'.format(retcode)
@@ -189,7 +660,9 @@ class EcflowContextManager(object):
         Update the message of an Ecflow node label, identified by its
         name.
         """
-        out, err, retcode = self.__run_cmd('label={0} "{1}"'.format(name, msg))
+        if self.__flusher is not None:
+            return self.__flusher.put('label', name, msg)
+        out, err, retcode = self.__run_cmd('label', name, msg)
         if retcode:
             raise EcflowrunError(
                 'Failed to set label message with return code {}'.format(retcode)
@@ -199,8 +672,64 @@ class EcflowContextManager(object):
         """
         Update the value of an Ecflow meter, identifier by its name.
         """
-        out, err, retcode = self.__run_cmd('meter={0} {1}'.format(name, val))
+        if self.__flusher is not None:
+            return self.__flusher.put('meter', name, val)
+        out, err, retcode = self.__run_cmd('meter', name, val)
         if retcode:
             raise EcflowrunError(
                 'Failed to update meter value with return code {}'.format(retcode)
             )
+
+    def step(self, name):
+        """
+        Return the context of the named step of the job. Its ``done``
+        attribute is true if the step was completed by a previous try,
+        and the step should be skipped:
+
+            with ctx.step('convert') as step:
+                if not step.done:
+                    convert()
+        """
+        if self.__journal is None:
+            self.__open_journal()
+        done = name in self.__completed_steps
+        if done:
+            self.__skipped_steps.append(name)
+            self.log(
+                'Skipping step {} completed by a previous try'.format(name),
+                logging.INFO
+            )
+        return Step(name, done, self.__start_step, self.__complete_step)
+
+    def track(self, iterable, meter='progress', total=None, interval=0.5):
+        """
+        Iterate over the given iterable, updating the named meter with
+        the progress made. The meter is set to the percentage of items
+        processed when the total number of items is known, either given
+        or from the length of the iterable, and to the number of items
+        processed otherwise.
+
+        Updates are only sent when the value changes, at most once every
+        ``interval`` seconds, and once more when the iteration ends.
+        """
+        if total is None and hasattr(iterable, '__len__'):
+            total = len(iterable)
+
+        def value(count):
+            if total:
+                return min(100, int(100 * count / total))
+            return count
+
+        last_value = None
+        last_time = 0
+        count = 0
+        for item in iterable:
+            yield item
+            count += 1
+            now = time.time()
+            if now - last_time >= interval and value(count) != last_value:
+                last_value = value(count)
+                last_time = now
+                self.meter(meter, last_value)
+        if value(count) != last_value:
+            self.meter(meter, value(count))
@@ -0,0 +1,278 @@
+"""
+Timing and resource usage instrumentation of the jobs run by the
+EcflowContextManager.
+"""
+import os
+import json
+import time
+import resource
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+# Upper bounds, in seconds, of the buckets of the child command latency
+# histograms
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+# Fields of getrusage kept for the jobs. The maximum resident set size
+# is in kilobytes, as reported on Linux.
+USAGE_FIELDS = ('utime', 'stime', 'maxrss', 'inblock', 'oublock', 'nvcsw', 'nivcsw')
+
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def rusage(who=resource.RUSAGE_SELF):
+    """
+    Return the fields of getrusage kept for the jobs, for the process or,
+    with RUSAGE_CHILDREN, for its children that were waited for.
+    """
+    return usage_fields(resource.getrusage(who))
+
+
+def usage_fields(r):
+    """
+    Return the fields kept for the jobs from a getrusage or wait4 result.
+    """
+    return dict((f, getattr(r, 'ru_' + f)) for f in USAGE_FIELDS)
+
+
+def usage_delta(before, after):
+    """
+    Resource usage between two rusage readings. The maximum resident set
+    size is a peak, so the later reading is kept.
+    """
+    delta = dict((f, after[f] - before[f]) for f in USAGE_FIELDS)
+    delta['maxrss'] = after['maxrss']
+    return delta
+
+
+def total_usage(usage):
+    """
+    Add up the usage of the process and of its children.
+    """
+    total = dict((f, usage['self'][f] + usage['children'][f]) for f in USAGE_FIELDS)
+    total['maxrss'] = max(usage['self']['maxrss'], usage['children']['maxrss'])
+    return total
+
+
+def format_usage(usage):
+    return (
+        'cpu {0:.2f}s user {1:.2f}s sys, max rss {2:.1f} MB, '
+        'io {3} in {4} out blocks, ctx switches {5} voluntary {6} involuntary'
+    ).format(
+        usage['utime'],
+        usage['stime'],
+        usage['maxrss'] / 1024.0,
+        usage['inblock'],
+        usage['oublock'],
+        usage['nvcsw'],
+        usage['nivcsw']
+    )
+
+
+class ResourceUsage(object):
+    """
+    Resource usage of the process and of its children, from ``start`` to
+    ``stop``. Usage of the process covers all of its threads, so it also
+    includes any other job run by the process at the same time.
+    """
+    def __init__(self):
+        self.usage = {}
+        self._started = None
+
+    def start(self):
+        self._started = {
+            'self': rusage(resource.RUSAGE_SELF),
+            'children': rusage(resource.RUSAGE_CHILDREN),
+        }
+
+    def stop(self):
+        if self._started is None:
+            return self.usage
+        self.usage = {
+            'self': usage_delta(self._started['self'], rusage(resource.RUSAGE_SELF)),
+            'children': usage_delta(
+                self._started['children'], rusage(resource.RUSAGE_CHILDREN)
+            ),
+        }
+        self._started = None
+        return self.usage
+
+
+class Histogram(object):
+    """
+    Latency histogram with fixed buckets.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        idx = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                idx = i
+                break
+        self.counts[idx] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        return {
+            'buckets': list(self.buckets),
+            'counts': self.counts,
+            'count': self.count,
+            'sum': self.sum,
+        }
+
+
+class JobMetrics(object):
+    """
+    Keeps the wall and CPU time spent on each phase of a job, the
+    latency histogram of the child commands, by command type, and the
+    resource usage of the job.
+    """
+    def __init__(self, task, tryno):
+        self.task = task
+        self.tryno = tryno
+        self.phases = {}
+        self.commands = {}
+        self.usage = ResourceUsage()
+        self._started = {}
+        self._lock = threading.Lock()
+
+    def start(self, phase):
+        self._started[phase] = (time.time(), _cpu_time())
+
+    def stop(self, phase):
+        if phase not in self._started:
+            return
+        wall, cpu = self._started.pop(phase)
+        self.phases[phase] = {
+            'wall': time.time() - wall,
+            'cpu': _cpu_time() - cpu,
+        }
+
+    @contextmanager
+    def phase(self, phase):
+        self.start(phase)
+        try:
+            yield
+        finally:
+            self.stop(phase)
+
+    def observe(self, cmd, seconds):
+        with self._lock:
+            if cmd not in self.commands:
+                self.commands[cmd] = Histogram()
+            self.commands[cmd].observe(seconds)
+
+    def to_dict(self):
+        return {
+            'task': self.task,
+            'tryno': self.tryno,
+            'phases': self.phases,
+            'commands': dict(
+                (cmd, h.to_dict()) for cmd, h in self.commands.items()
+            ),
+            'usage': self.usage.usage,
+        }
+
+    def to_json(self):
+        return json.dumps({'ecflowrun_metrics': self.to_dict()}, sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        Format the metrics in the Prometheus text exposition format.
+        """
+        task = self.task.replace('\\', '\\\\').replace('"', '\\"')
+        lines = [
+            '# TYPE ecflowrun_job_phase_wall_seconds gauge',
+        ]
+        for phase, t in sorted(self.phases.items()):
+            lines.append(
+                'ecflowrun_job_phase_wall_seconds{{task="{0}",phase="{1}"}} {2}'.format(
+                    task, phase, t['wall']
+                )
+            )
+        lines.append('# TYPE ecflowrun_job_phase_cpu_seconds gauge')
+        for phase, t in sorted(self.phases.items()):
+            lines.append(
+                'ecflowrun_job_phase_cpu_seconds{{task="{0}",phase="{1}"}} {2}'.format(
+                    task, phase, t['cpu']
+                )
+            )
+        lines.append('# TYPE ecflowrun_child_command_seconds histogram')
+        for cmd, h in sorted(self.commands.items()):
+            labels = 'task="{0}",command="{1}"'.format(task, cmd)
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                lines.append(
+                    'ecflowrun_child_command_seconds_bucket{{{0},le="{1}"}} {2}'.format(
+                        labels, bound, cumulative
+                    )
+                )
+            lines.append(
+                'ecflowrun_child_command_seconds_bucket{{{0},le="+Inf"}} {1}'.format(
+                    labels, h.count
+                )
+            )
+            lines.append(
+                'ecflowrun_child_command_seconds_sum{{{0}}} {1}'.format(labels, h.sum)
+            )
+            lines.append(
+                'ecflowrun_child_command_seconds_count{{{0}}} {1}'.format(labels, h.count)
+            )
+        lines.append('# TYPE ecflowrun_job_resource_usage gauge')
+        for scope, usage in sorted(self.usage.usage.items()):
+            for field in USAGE_FIELDS:
+                lines.append(
+                    'ecflowrun_job_resource_usage{{task="{0}",scope="{1}",field="{2}"}} {3}'.format(
+                        task, scope, field, usage[field]
+                    )
+                )
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Write the metrics to a file read by the Prometheus textfile
+        collector. The file is replaced atomically, so the collector
+        never reads it half written.
+        """
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), prefix='.ecflowrun'
+        )
+        with os.fdopen(fd, 'w') as fp:
+            fp.write(self.to_prometheus())
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+
+
+class TimedTransport(object):
+    """
+    Transport wrapper that records the latency of every child command
+    sent through the wrapped transport.
+    """
+    def __init__(self, transport, metrics):
+        self._transport = transport
+        self._metrics = metrics
+
+    def send(self, cmd, *args):
+        start = time.time()
+        try:
+            return self._transport.send(cmd, *args)
+        finally:
+            self._metrics.observe(cmd, time.time() - start)
+
+    def close(self):
+        self._transport.close()
@@ -0,0 +1,99 @@
+"""
+Opt-in profiling of the jobs, with cProfile for the CPU time and
+tracemalloc for the memory allocations.
+"""
+import logging
+
+try:
+    import cProfile
+except ImportError:
+    cProfile = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+PROFILE_MODES = ('cpu', 'memory')
+
+
+def parse_profile_modes(value):
+    """
+    Parse the value of the ECFLOWRUN_PROFILE variable, a comma separated
+    list of profiling modes, where ``all`` selects every mode.
+    """
+    modes = set()
+    for mode in (value or '').split(','):
+        mode = mode.strip().lower()
+        if mode == 'all':
+            modes.update(PROFILE_MODES)
+        elif mode:
+            modes.add(mode)
+    return modes
+
+
+class JobProfiler(object):
+    """
+    Profiler of the body of a job. With the ``cpu`` mode, the cProfile
+    statistics are dumped to ``<prefix>.prof``, to be read with pstats
+    or snakeviz. With the ``memory`` mode, the ``top`` lines allocating
+    the most memory are written to ``<prefix>.mem``.
+
+    Only the thread starting the profiler is profiled for CPU time.
+    """
+    def __init__(self, modes, prefix, top=50, logger=None):
+        self.prefix = prefix
+        self.top = top
+        self._logger = logger or logging.getLogger(__name__)
+        self._modes = set(modes)
+        for mode in self._modes - set(PROFILE_MODES):
+            self._logger.warning('Unknown profiling mode {}'.format(mode))
+        if 'memory' in self._modes and tracemalloc is None:
+            self._logger.warning('Memory profiling needs the tracemalloc module')
+            self._modes.discard('memory')
+        if 'cpu' in self._modes and cProfile is None:
+            self._logger.warning('CPU profiling needs the cProfile module')
+            self._modes.discard('cpu')
+        self._profile = None
+        self._tracing = False
+
+    def start(self):
+        if 'memory' in self._modes and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        if 'cpu' in self._modes:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self):
+        """
+        Stop profiling and write the results, returning the paths of the
+        files written.
+        """
+        paths = []
+        if self._profile is not None:
+            self._profile.disable()
+            path = self.prefix + '.prof'
+            self._profile.dump_stats(path)
+            self._profile = None
+            paths.append(path)
+        if 'memory' in self._modes and tracemalloc.is_tracing():
+            path = self.prefix + '.mem'
+            self._write_memory(path)
+            if self._tracing:
+                tracemalloc.stop()
+                self._tracing = False
+            paths.append(path)
+        return paths
+
+    def _write_memory(self, path):
+        current, peak = tracemalloc.get_traced_memory()
+        stats = tracemalloc.take_snapshot().statistics('lineno')
+        with open(path, 'w') as fp:
+            fp.write('Traced memory: current {0:.1f} MB, peak {1:.1f} MB\n'.format(
+                current / 1048576.0, peak / 1048576.0
+            ))
+            fp.write('Top {} lines by allocated memory:\n'.format(self.top))
+            for stat in stats[:self.top]:
+                fp.write('{}\n'.format(stat))
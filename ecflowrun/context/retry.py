@@ -0,0 +1,145 @@
+"""
+Retries of the child commands that fail, and a circuit breaker that
+stops sending non critical commands while the server is unhealthy.
+"""
+import time
+import random
+import logging
+import threading
+
+
+class RetryPolicy(object):
+    """
+    Retry a command up to ``attempts`` times in total, waiting between
+    attempts a random time up to an exponentially growing limit, from
+    ``base_delay`` up to ``max_delay`` seconds (full jitter), without
+    going beyond ``deadline`` seconds since the first attempt.
+    """
+    def __init__(self, attempts=5, base_delay=0.5, max_delay=30.0, deadline=300.0):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def delay(self, attempt):
+        """
+        Time to wait after the given failed attempt, starting at 0.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+# Policies that can be used as a starting point. Init and completion
+# are retried for the longest, as failing them wastes the whole job.
+DEFAULT_RETRY_POLICIES = {
+    'init': RetryPolicy(attempts=8, base_delay=1.0, max_delay=60.0, deadline=600.0),
+    'complete': RetryPolicy(attempts=8, base_delay=1.0, max_delay=60.0, deadline=600.0),
+    'abort': RetryPolicy(attempts=5, base_delay=1.0, max_delay=30.0, deadline=120.0),
+    'event': RetryPolicy(attempts=5, base_delay=0.5, max_delay=10.0, deadline=60.0),
+    'label': RetryPolicy(attempts=1),
+    'meter': RetryPolicy(attempts=1),
+}
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker that opens after ``failure_threshold`` consecutive
+    failures, refusing every request for ``reset_timeout`` seconds.
+    After that, a single request is let through, closing the circuit
+    if it succeeds and opening it again otherwise.
+    """
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._trial and time.time() - self._opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.time()
+                self._trial = False
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+
+class RetryingTransport(object):
+    """
+    Transport wrapper that retries the failed commands following the
+    policy of each command type. Commands without a policy are sent
+    once.
+
+    The commands in ``breaker_commands`` also go through the circuit
+    breaker: while it is open they are dropped instead of adding load
+    to a server that is already struggling. These commands are reported
+    as successful even when dropped or failed, so that the job carries
+    on.
+    """
+    def __init__(self, transport, policies=None, breaker=None,
+                 breaker_commands=('meter', 'label'), logger=None):
+        self._transport = transport
+        self._policies = policies or {}
+        self._breaker = breaker
+        self._breaker_commands = set(breaker_commands)
+        self._logger = logger or logging.getLogger(__name__)
+
+    def send(self, cmd, *args):
+        breaker = self._breaker if cmd in self._breaker_commands else None
+        if breaker is not None and not breaker.allow():
+            self._logger.debug('Server unhealthy, dropped {}'.format(cmd))
+            return '', 'Dropped while the server is unhealthy', 0
+
+        policy = self._policies.get(cmd)
+        start = time.time()
+        attempt = 0
+        while True:
+            out, err, retcode = self._transport.send(cmd, *args)
+            if breaker is not None:
+                if retcode:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            if not retcode:
+                return out, err, retcode
+
+            delay = policy.delay(attempt) if policy is not None else 0
+            if (policy is None or attempt + 1 >= policy.attempts or
+                    time.time() - start + delay > policy.deadline or
+                    (breaker is not None and breaker.is_open)):
+                break
+            self._logger.warning(
+                'Command {0} failed with return code {1}, retrying in {2:.1f}s'.format(
+                    cmd, retcode, delay
+                )
+            )
+            time.sleep(delay)
+            attempt += 1
+
+        if breaker is not None:
+            self._logger.warning(
+                'Command {0} failed with return code {1}, dropped'.format(cmd, retcode)
+            )
+            return out, err, 0
+        return out, err, retcode
+
+    def close(self):
+        self._transport.close()
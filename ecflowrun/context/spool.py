@@ -0,0 +1,274 @@
+"""
+Durable spool of the child commands that could not be delivered to the
+server, and their replay once the server is reachable again.
+"""
+import os
+import json
+import time
+import errno
+import fcntl
+import logging
+import tempfile
+
+from ecflowrun.context.transport import (
+    get_transport, runtime_dir, make_private_dir, is_connection_error
+)
+
+
+SPOOL_SUFFIX = '.spool'
+
+# Commands whose spooling is synced to disk immediately, as they mark
+# the end of the job
+CRITICAL_COMMANDS = ('complete', 'abort')
+
+# Commands skipped when the server rejects them, so that the commands
+# spooled after them are still delivered
+SKIPPABLE_COMMANDS = ('event', 'label', 'meter')
+
+
+def default_spool_dir():
+    """
+    Directory where the spool files are kept, which can be changed
+    through the ECFLOWRUN_SPOOL_DIR variable.
+    """
+    return os.getenv('ECFLOWRUN_SPOOL_DIR', os.path.join(runtime_dir(), 'spool'))
+
+
+class Spool(object):
+    """
+    Append only journal of child commands, one JSON document per line.
+    Writes are synced to disk every ``sync_every`` commands and for
+    every critical command.
+
+    The records hold the variables of the job, its password included,
+    so the spool directory and files are only accessible by the user.
+    """
+    def __init__(self, path, sync_every=16):
+        self.path = path
+        self.sync_every = sync_every
+        self._fp = None
+        self._unsynced = 0
+
+    def append(self, env, cmd, args):
+        record = {'env': env, 'cmd': cmd, 'args': list(args), 'time': time.time()}
+        self._open()
+        self._fp.write(json.dumps(record) + '\n')
+        self._unsynced += 1
+        if cmd in CRITICAL_COMMANDS or self._unsynced >= self.sync_every:
+            self.sync()
+        return record
+
+    def _open(self):
+        if self._fp is not None:
+            return
+        make_private_dir(os.path.dirname(os.path.abspath(self.path)))
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        self._fp = os.fdopen(fd, 'a')
+        # Held until the spool is closed, so that the file is not
+        # replayed while the job is still writing to it
+        fcntl.flock(self._fp, fcntl.LOCK_EX)
+
+    def replace(self, records):
+        """
+        Replace the contents of the spool with the given records, the
+        ones still to be delivered. The file is removed when none are
+        left.
+        """
+        if not records:
+            self.close()
+            try:
+                os.unlink(self.path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            return
+        self._open()
+        self._fp.flush()
+        self._fp.truncate(0)
+        for record in records:
+            self._fp.write(json.dumps(record) + '\n')
+        self._unsynced += 1
+        self.sync()
+
+    def sync(self):
+        if self._fp is not None and self._unsynced:
+            self._fp.flush()
+            os.fsync(self._fp.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        if self._fp is not None:
+            self.sync()
+            self._fp.close()
+            self._fp = None
+
+    @property
+    def empty(self):
+        return not os.path.exists(self.path)
+
+
+def read_spool(path):
+    """
+    Read the commands of a spool file, ignoring a last line left
+    incomplete by an interrupted write.
+    """
+    records = []
+    with open(path) as fp:
+        for line in fp:
+            if not line.endswith('\n'):
+                break
+            records.append(json.loads(line))
+    return records
+
+
+def replay_file(path, deadline=None, retry_delay=1.0, transport=None):
+    """
+    Send the commands of a spool file, in order, until all are
+    delivered or ``deadline`` (a time.time() value) is reached. The file
+    is removed once every command is delivered. Otherwise, it is
+    rewritten with the commands left and false is returned. Files still
+    being written by a job are skipped.
+    """
+    with open(path) as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            return False
+        try:
+            return _replay_locked(path, deadline, retry_delay, transport)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _replay_locked(path, deadline, retry_delay, transport):
+    logger = logging.getLogger(__name__)
+    records = read_spool(path)
+    sent = 0
+    while sent < len(records):
+        record = records[sent]
+        if transport is None:
+            transport = get_transport(record['env'])
+        out, err, retcode = transport.send(record['cmd'], *record['args'])
+        if not retcode:
+            sent += 1
+            continue
+        if record['cmd'] in SKIPPABLE_COMMANDS and not is_connection_error(err):
+            logger.warning(
+                'Replay of {0} from {1} rejected by the server, skipped: {2}'.format(
+                    record['cmd'], path, err
+                )
+            )
+            sent += 1
+            continue
+        logger.warning(
+            'Replay of {0} from {1} failed with return code {2}'.format(
+                record['cmd'], path, retcode
+            )
+        )
+        if deadline is None or time.time() + retry_delay > deadline:
+            break
+        time.sleep(retry_delay)
+    if transport is not None:
+        transport.close()
+
+    if sent == len(records):
+        os.unlink(path)
+        return True
+    if sent:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.replay')
+        with os.fdopen(fd, 'w') as fp:
+            for record in records[sent:]:
+                fp.write(json.dumps(record) + '\n')
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.rename(tmp_path, path)
+    return False
+
+
+def replay_dir(spool_dir=None, deadline=None):
+    """
+    Replay every spool file of a directory, oldest first. Returns the
+    number of files that still have commands left.
+    """
+    spool_dir = spool_dir or default_spool_dir()
+    if not os.path.isdir(spool_dir):
+        return 0
+    names = sorted(n for n in os.listdir(spool_dir) if n.endswith(SPOOL_SUFFIX))
+    left = 0
+    for name in names:
+        if not replay_file(os.path.join(spool_dir, name), deadline):
+            left += 1
+    return left
+
+
+class SpoolingTransport(object):
+    """
+    Transport wrapper that writes to the spool the commands that do not
+    reach the server, reporting them as delivered. Commands the server
+    rejected are reported as failed, as sending them again would not
+    help. Commands not in ``commands`` (by default, the init) are never
+    spooled.
+
+    Before sending a new command, the spooled ones are delivered, in
+    order, so that the job goes back to sending its commands as soon as
+    the server is reachable again. While any command is left in the
+    spool, new commands are spooled after it, so that their order is
+    kept. Spooled events, labels and meters rejected by the server are
+    logged and skipped.
+    """
+    def __init__(self, transport, spool, env,
+                 commands=('complete', 'abort', 'event', 'label', 'meter')):
+        self._transport = transport
+        self._spool = spool
+        self._env = env
+        self._commands = set(commands)
+        self._pending = []
+        self._logger = logging.getLogger(__name__)
+
+    def _drain(self):
+        """
+        Deliver the spooled commands, in order, returning true if none
+        are left.
+        """
+        sent = 0
+        for record in self._pending:
+            out, err, retcode = self._transport.send(record['cmd'], *record['args'])
+            if retcode and is_connection_error(err):
+                break
+            if retcode:
+                self._logger.warning(
+                    'Spooled {0} rejected by the server, skipped: {1}'.format(
+                        record['cmd'], err
+                    )
+                )
+            sent += 1
+        if sent:
+            self._pending = self._pending[sent:]
+            self._spool.replace(self._pending)
+            if not self._pending:
+                self._logger.info('Spooled commands delivered')
+        return not self._pending
+
+    def send(self, cmd, *args):
+        if not self._pending or self._drain():
+            out, err, retcode = self._transport.send(cmd, *args)
+            if (not retcode or cmd not in self._commands or
+                    not is_connection_error(err)):
+                return out, err, retcode
+            self._logger.warning(
+                'Command {0} failed with return code {1}, spooled to {2}'.format(
+                    cmd, retcode, self._spool.path
+                )
+            )
+        elif cmd not in self._commands:
+            return self._transport.send(cmd, *args)
+        self._pending.append(self._spool.append(self._env, cmd, args))
+        return '', '', 0
+
+    def close(self):
+        self._spool.close()
+        self._transport.close()
+
+    @property
+    def spooling(self):
+        return bool(self._pending)
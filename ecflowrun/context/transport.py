@@ -0,0 +1,359 @@
+"""
+Transports used by the EcflowContextManager to deliver child commands
+(init, complete, abort, event, label and meter) to the Ecflow server.
+
+Every transport exposes a ``send`` method that receives the name of the
+child command and its arguments, and returns a tuple with the command
+output, error and return code, the same way a call to the
+``ecflow_client`` would, and a ``close`` method called once the job ends.
+"""
+import os
+import json
+import stat
+import errno
+import socket
+import tempfile
+import threading
+import subprocess
+
+from ecflowrun.errors import EcflowrunError
+
+try:
+    from ecflow import ecflow
+except ImportError:
+    ecflow = None
+
+
+class SubprocessTransport(object):
+    """
+    Sends the child commands by running the ``ecflow_client`` executable
+    on a child process. This is the slowest transport, as it forks the
+    current process for every command, but has no requirements other
+    than having the Ecflow binaries available on the PATH.
+    """
+    def __init__(self, env):
+        self._env = env
+
+    def _build_args(self, cmd, args):
+        if cmd == 'init':
+            return ['--init={}'.format(args[0])]
+        elif cmd == 'complete':
+            return ['--complete']
+        elif cmd == 'abort':
+            return ['--abort={}'.format(args[0])]
+        elif cmd == 'event':
+            return ['--event={}'.format(args[0])]
+        elif cmd == 'label':
+            return ['--label={}'.format(args[0]), '{}'.format(args[1])]
+        elif cmd == 'meter':
+            return ['--meter={}'.format(args[0]), '{}'.format(args[1])]
+        raise EcflowrunError('Unknown child command {}'.format(cmd))
+
+    def send(self, cmd, *args):
+        env = dict(os.environ)
+        for k, v in self._env.items():
+            env[k] = str(v)
+        process = subprocess.Popen(
+            ['ecflow_client'] + self._build_args(cmd, args),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env
+        )
+        out, err = process.communicate()
+        retcode = process.returncode
+        return out, err, retcode
+
+    def close(self):
+        pass
+
+
+class ClientTransport(object):
+    """
+    Sends the child commands in-process, through the child API of the
+    ecflow.Client, avoiding the cost of forking a new process for every
+    command sent to the server.
+
+    An existing ecflow.Client can be given, which is then set up to send
+    the child commands on behalf of the job described by ``env``.
+    """
+    def __init__(self, env, client=None):
+        if client is None:
+            if ecflow is None:
+                raise EcflowrunError('The ecflow module is not available')
+            client = ecflow.Client(str(env['ECF_NODE']), str(env['ECF_PORT']))
+        self._client = client
+        self._setup_child(env)
+
+    def _setup_child(self, env):
+        self._client.set_child_path(str(env['ECF_NAME']))
+        self._client.set_child_password(str(env['ECF_PASS']))
+        self._client.set_child_pid(str(env['ECF_RID']))
+        self._client.set_child_try_no(int(env['ECF_TRYNO']))
+
+    def _dispatch(self, cmd, args):
+        if cmd == 'init':
+            self._client.child_init()
+        elif cmd == 'complete':
+            self._client.child_complete()
+        elif cmd == 'abort':
+            self._client.child_abort('{}'.format(args[0]))
+        elif cmd == 'event':
+            self._client.child_event('{}'.format(args[0]))
+        elif cmd == 'label':
+            self._client.child_label('{}'.format(args[0]), '{}'.format(args[1]))
+        elif cmd == 'meter':
+            self._client.child_meter('{}'.format(args[0]), int(args[1]))
+        else:
+            raise EcflowrunError('Unknown child command {}'.format(cmd))
+
+    def send(self, cmd, *args):
+        try:
+            self._dispatch(cmd, args)
+        except RuntimeError as e:
+            return '', str(e), 1
+        except (ValueError, TypeError) as e:
+            # Arguments rejected, as ecflow_client would do for a meter
+            # value that is not a number
+            return '', 'Invalid arguments for {0}: {1}'.format(cmd, e), 1
+        return '', '', 0
+
+    def close(self):
+        pass
+
+
+# Clients shared by the jobs of the process, by server, each with the
+# lock that serializes its use
+_SHARED_CLIENTS = {}
+_SHARED_CLIENTS_LOCK = threading.Lock()
+
+
+def _shared_client(host, port):
+    with _SHARED_CLIENTS_LOCK:
+        if (host, port) not in _SHARED_CLIENTS:
+            _SHARED_CLIENTS[(host, port)] = (ecflow.Client(host, port), threading.Lock())
+        return _SHARED_CLIENTS[(host, port)]
+
+
+class SharedClientTransport(ClientTransport):
+    """
+    Sends the child commands in-process, through an ecflow.Client shared
+    by every job of the process talking to the same server, which is set
+    up for the job on every command. Meant for processes running many
+    jobs at once from different threads.
+    """
+    def __init__(self, env):
+        if ecflow is None:
+            raise EcflowrunError('The ecflow module is not available')
+        self._env = env
+        self._client, self._lock = _shared_client(
+            str(env['ECF_NODE']), str(env['ECF_PORT'])
+        )
+
+    def send(self, cmd, *args):
+        with self._lock:
+            self._setup_child(self._env)
+            return ClientTransport.send(self, cmd, *args)
+
+
+def runtime_dir():
+    """
+    Directory, private to the user, where the sockets of the node-local
+    daemons are kept by default.
+    """
+    return os.path.join(tempfile.gettempdir(), 'ecflowrun-{}'.format(os.getuid()))
+
+
+def _make_dir(directory, check):
+    try:
+        os.mkdir(directory, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    if check:
+        st = os.lstat(directory)
+        if (not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or
+                st.st_mode & 0o077):
+            raise EcflowrunError('Unsafe runtime directory {}'.format(directory))
+
+
+def make_private_dir(directory):
+    """
+    Create a directory only accessible by the user. The default runtime
+    directory, and the directories created in it, must also be owned by
+    the user and not accessible by anyone else, or an error is raised.
+    """
+    directory = os.path.abspath(directory)
+    runtime = runtime_dir()
+    if directory != runtime and not directory.startswith(runtime + os.sep):
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        return
+    _make_dir(runtime, True)
+    path = runtime
+    for part in os.path.relpath(directory, runtime).split(os.sep):
+        if part == os.curdir:
+            continue
+        path = os.path.join(path, part)
+        _make_dir(path, True)
+
+
+def make_socket_dir(path):
+    """
+    Create the directory of a daemon socket, only accessible by the
+    user, see make_private_dir.
+    """
+    make_private_dir(os.path.dirname(os.path.abspath(path)))
+
+
+def is_own_socket(path):
+    """
+    Return true if the path is a socket owned by the user, so that the
+    job variables, passwords included, are never sent to a socket
+    created by someone else.
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(st.st_mode) and st.st_uid == os.getuid()
+
+
+# Words found in the errors of the commands that did not reach the
+# server, as opposed to the ones the server rejected
+CONNECTION_ERRORS = (
+    'connect', 'timed out', 'timeout', 'broken pipe', 'reset by peer',
+    'host not found', 'unreachable', 'no route to host', 'end of file',
+)
+
+
+def is_connection_error(err):
+    """
+    Return true if the error of a failed child command means that the
+    command did not reach the server, so that it can be sent again.
+    """
+    if isinstance(err, bytes):
+        err = err.decode('utf-8', 'replace')
+    err = (err or '').lower()
+    return any(word in err for word in CONNECTION_ERRORS)
+
+
+def default_relay_socket():
+    """
+    Path of the Unix socket where the node-local relay listens, which
+    can be changed through the ECFLOWRUN_RELAY_SOCKET variable.
+    """
+    return os.getenv(
+        'ECFLOWRUN_RELAY_SOCKET', os.path.join(runtime_dir(), 'relay.sock')
+    )
+
+
+def _local_transport(env):
+    if ecflow is not None:
+        return ClientTransport(env)
+    return SubprocessTransport(env)
+
+
+class RelayTransport(object):
+    """
+    Sends the child commands to the node-local relay started with
+    ``ecflow_admin relay``, over a persistent Unix socket connection.
+    The relay forwards them to the server on behalf of the job.
+
+    Requests and replies are JSON documents, one per line. If the relay
+    is not running, or a request cannot be written to it, the commands
+    are transparently sent through the in-process client or
+    ecflow_client instead. The same happens if the socket is not owned
+    by the user. A command sent to the relay without getting a reply is
+    reported as failed, as the relay may still deliver it.
+    """
+    def __init__(self, env, path=None, timeout=30.0):
+        self._env = env
+        self._fallback = None
+        self._sock = None
+        path = path or default_relay_socket()
+        if not is_own_socket(path):
+            return
+        try:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(timeout)
+            sock.connect(path)
+        except socket.error:
+            return
+        self._sock = sock
+        self._reader = sock.makefile('rb')
+
+    def _close(self):
+        try:
+            self._reader.close()
+            self._sock.close()
+        except socket.error:
+            pass
+        self._sock = None
+
+    def _send_fallback(self, cmd, args):
+        if self._fallback is None:
+            self._fallback = _local_transport(self._env)
+        return self._fallback.send(cmd, *args)
+
+    def send(self, cmd, *args):
+        if self._sock is None:
+            return self._send_fallback(cmd, args)
+        request = json.dumps({'env': self._env, 'cmd': cmd, 'args': args})
+        try:
+            self._sock.sendall((request + '\n').encode('utf-8'))
+        except socket.error:
+            self._close()
+            return self._send_fallback(cmd, args)
+        # The relay may still deliver a command that got no reply, so it
+        # is reported as failed rather than sent again. The connection
+        # cannot be trusted anymore, and later commands fall back.
+        try:
+            line = self._reader.readline()
+        except socket.error:
+            line = None
+        if not line:
+            self._close()
+            return '', 'No reply from the relay to {}'.format(cmd), 1
+        reply = json.loads(line.decode('utf-8'))
+        return reply['out'], reply['err'], reply['retcode']
+
+    def close(self):
+        if self._sock is not None:
+            self._close()
+        if self._fallback is not None:
+            self._fallback.close()
+
+
+# Transports that can be selected by name when creating a new
+# EcflowContextManager
+TRANSPORTS = {
+    'subprocess': SubprocessTransport,
+    'client': ClientTransport,
+    'shared': SharedClientTransport,
+    'relay': RelayTransport,
+}
+
+
+def get_transport(env, transport=None):
+    """
+    Build the transport used to send the child commands of a job. The
+    transport can be given by name, as an already built instance or
+    left unset, in which case the node-local relay is used when it is
+    running. Otherwise, the in-process client is used if the ecflow
+    module is available, falling back to ecflow_client.
+    """
+    if transport is None or transport == 'auto':
+        if is_own_socket(default_relay_socket()):
+            transport = 'relay'
+        elif ecflow is not None:
+            transport = 'client'
+        else:
+            transport = 'subprocess'
+    if not isinstance(transport, str):
+        return transport
+    if transport not in TRANSPORTS:
+        raise EcflowrunError('Unknown transport {}'.format(transport))
+    return TRANSPORTS[transport](env)
@@ -1,12 +1,20 @@
 """
 Administration utilities for Ecflow.
 """
-from ecflow import ecflow
-
 import os
+import json
 import argparse
-import subprocess
-import shlex
+
+from ecflowrun.server.relay import run_relay
+from ecflowrun.server.loadtest import run_loadtest, parse_mix, format_report
+from ecflowrun.server.status import (
+    parse_servers, probe_servers, format_status
+)
+from ecflowrun.server.mirror import SuiteMirror
+from ecflowrun.server.bulk import OPERATIONS, bulk_apply, format_summary
+from ecflowrun.server.worker import run_worker, default_worker_socket
+from ecflowrun.context.transport import default_relay_socket
+from ecflowrun.context.spool import replay_dir
 
 
 def ecflow_admin():
@@ -22,11 +30,73 @@ def ecflow_admin():
     home = args.home
 
     if action == 'status':
-        _ping_server(host, port)
+        servers = parse_servers(args.servers, args.servers_file) or [(host, port)]
+        results = probe_servers(servers, args.timeout)
+        if args.json:
+            print(json.dumps(results, indent=2, sort_keys=True))
+        else:
+            print(format_status(results))
     elif action == 'start':
         _start_server(host, port, home)
     elif action == 'stop':
         _stop_server(host, port)
+    elif action == 'relay':
+        run_relay(args.socket or default_relay_socket(), args.pool_size)
+    elif action == 'loadtest':
+        report = run_loadtest(
+            args.jobs,
+            args.concurrency,
+            parse_mix(args.mix),
+            host,
+            port,
+            task=args.task,
+            standin=args.standin,
+            latency=args.standin_latency
+        )
+        if args.json:
+            print(json.dumps(report, indent=2, sort_keys=True))
+        else:
+            print(format_report(report))
+    elif action == 'replay':
+        left = replay_dir(args.spool_dir)
+        if left:
+            print('{} spool files could not be fully replayed'.format(left))
+        else:
+            print('All spooled commands delivered')
+    elif action == 'watch':
+        suites = args.suites.split(',') if args.suites else None
+        mirror = SuiteMirror(host, port, suites)
+        mirror.watch(args.interval, args.snapshot, _print_mirror_summary)
+    elif action == 'worker':
+        run_worker(
+            args.socket or default_worker_socket(),
+            args.workers,
+            args.preload.split(',') if args.preload else ()
+        )
+    elif action == 'bulk':
+        if not args.nodes:
+            parser.error('The bulk action needs --nodes')
+        variable = None
+        if args.variable:
+            name, sep, value = args.variable.partition('=')
+            if not sep:
+                parser.error('Expected --variable as NAME=VALUE')
+            variable = (name, value)
+        summary = bulk_apply(
+            host,
+            port,
+            args.nodes.split(','),
+            args.operation,
+            variable=variable,
+            state=args.state,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+            progress=None if args.json else _print_bulk_progress
+        )
+        if args.json:
+            print(json.dumps(summary, indent=2, sort_keys=True))
+        else:
+            print(format_summary(summary))
 
 
 def _build_cmd_parser():
@@ -51,12 +121,152 @@ def _build_cmd_parser():
         help='Home directory to run the server',
         default=os.path.join(os.getenv('HOME'), '.ecflow_server')
     )
+    parser.add_argument(
+        '--servers',
+        help='Comma separated list of host:port of the servers to check',
+        default=None
+    )
+    parser.add_argument(
+        '--servers-file',
+        help='File with the host:port of the servers to check, one per line',
+        default=None
+    )
+    parser.add_argument(
+        '-t',
+        '--timeout',
+        help='Seconds to wait for each server to reply',
+        type=float,
+        default=10.0
+    )
+    parser.add_argument(
+        '-s',
+        '--socket',
+        help='Unix socket where the relay or the worker daemon listens',
+        default=None
+    )
+    parser.add_argument(
+        '--pool-size',
+        help='Number of clients kept by the relay for each server',
+        type=int,
+        default=8
+    )
+    parser.add_argument(
+        '--workers',
+        help='Number of warm processes kept by the worker daemon',
+        type=int,
+        default=4
+    )
+    parser.add_argument(
+        '--preload',
+        help='Comma separated list of modules imported by the worker daemon',
+        default=None
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        help='Number of jobs simulated by the load test',
+        type=int,
+        default=100
+    )
+    parser.add_argument(
+        '-c',
+        '--concurrency',
+        help='Number of jobs running at the same time in the load test',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--mix',
+        help='Child commands sent by each load test job, as event=N,label=N,meter=N',
+        default='event=5,label=5,meter=20'
+    )
+    parser.add_argument(
+        '--task',
+        help='Path of the load test jobs, formatted with the job number',
+        default='/loadtest/t{}'
+    )
+    parser.add_argument(
+        '--standin',
+        help='Run the load test against a local server stand-in',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--standin-latency',
+        help='Seconds taken by the server stand-in to reply to each command',
+        type=float,
+        default=0.0
+    )
+    parser.add_argument(
+        '--spool-dir',
+        help='Directory with the spooled commands to replay',
+        default=None
+    )
+    parser.add_argument(
+        '--suites',
+        help='Comma separated list of the suites to watch, all by default',
+        default=None
+    )
+    parser.add_argument(
+        '--interval',
+        help='Seconds between each sync with the watched server',
+        type=float,
+        default=10.0
+    )
+    parser.add_argument(
+        '--snapshot',
+        help='File where the watched state is written as JSON',
+        default=None
+    )
+    parser.add_argument(
+        '--nodes',
+        help='Comma separated list of the node path patterns changed in bulk',
+        default=None
+    )
+    parser.add_argument(
+        '--operation',
+        help='Change applied in bulk to the nodes',
+        choices=OPERATIONS,
+        default='requeue'
+    )
+    parser.add_argument(
+        '--variable',
+        help='Variable changed by the alter operation, as NAME=VALUE',
+        default=None
+    )
+    parser.add_argument(
+        '--state',
+        help='State set by the force operation',
+        choices=['unknown', 'complete', 'queued', 'aborted', 'submitted', 'active'],
+        default=None
+    )
+    parser.add_argument(
+        '--batch-size',
+        help='Number of nodes changed by each request to the server',
+        type=int,
+        default=500
+    )
+    parser.add_argument(
+        '--dry-run',
+        help='List the nodes that would be changed in bulk without changing them',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--json',
+        help='Print the results as JSON',
+        action='store_true'
+    )
     parser.add_argument(
         'action',
         choices=[
             'start',
             'stop',
-            'status'
+            'status',
+            'relay',
+            'loadtest',
+            'replay',
+            'watch',
+            'bulk',
+            'worker'
         ],
         help='Task to be performed'
     )
@@ -64,24 +274,20 @@ def _build_cmd_parser():
     return parser
 
 
-def _start_server(host, port, home):
-    pass
+def _print_mirror_summary(mirror):
+    counts = mirror.state_counts()
+    print('{0} nodes: {1}'.format(
+        len(mirror.index),
+        ', '.join('{0}={1}'.format(k, v) for k, v in sorted(counts.items()))
+    ))
 
 
-def _ping_server(host, port):
-    """
-    Uses an instance of ecflow.Client to ping the target server. Returns
-    true if the server replies correctly and false otherwise.
-    """
-    try:
-        cl = ecflow.Client(host, port)
-        cl.ping()
-    except RuntimeError as e:
-        print 'Server is not running'
-        return False
-    else:
-        print 'Server is up and running'
-        return True
+def _print_bulk_progress(done, total):
+    print('{0}/{1} nodes'.format(done, total))
+
+
+def _start_server(host, port, home):
+    pass
 
 
 def _stop_server(port):
@@ -0,0 +1,115 @@
+"""
+Changes applied to many nodes of a server at once, sending the node
+paths in batches instead of one request per node.
+"""
+import time
+import fnmatch
+
+from ecflowrun.errors import EcflowrunError
+from ecflowrun.context.transport import ecflow
+
+
+OPERATIONS = ('requeue', 'suspend', 'resume', 'alter', 'force')
+
+
+def resolve_nodes(defs, patterns):
+    """
+    Return the paths of the nodes of a definition matching any of the
+    shell style ``patterns``, in the order of the definition.
+    """
+    paths = []
+    for suite in defs.suites:
+        nodes = [suite]
+        nodes.extend(suite.get_all_nodes())
+        for node in nodes:
+            path = node.get_abs_node_path()
+            if any(fnmatch.fnmatchcase(path, p) for p in patterns):
+                paths.append(path)
+    return paths
+
+
+def _batches(paths, size):
+    for idx in range(0, len(paths), size):
+        yield paths[idx:idx + size]
+
+
+def _apply(client, operation, paths, variable=None, state=None):
+    if operation == 'requeue':
+        client.requeue(paths)
+    elif operation == 'suspend':
+        client.suspend(paths)
+    elif operation == 'resume':
+        client.resume(paths)
+    elif operation == 'alter':
+        name, value = variable
+        client.alter(paths, 'change', 'variable', name, value)
+    elif operation == 'force':
+        client.force_state(paths, getattr(ecflow.State, state))
+
+
+def bulk_apply(host, port, patterns, operation, variable=None, state=None,
+               batch_size=500, dry_run=False, progress=None):
+    """
+    Apply an operation to every node matching the path ``patterns``,
+    resolved against a single fetch of the definition. The paths are
+    sent ``batch_size`` at a time, calling ``progress`` with the number
+    of nodes done and the total after each batch.
+
+    The ``alter`` operation changes the ``variable``, a (name, value)
+    pair, and ``force`` sets the nodes to the given ``state``. Returns a
+    summary with the number of nodes and batches and the time taken.
+    """
+    if ecflow is None:
+        raise EcflowrunError('The ecflow module is not available')
+    if operation not in OPERATIONS:
+        raise EcflowrunError('Unknown bulk operation {}'.format(operation))
+    if operation == 'alter' and variable is None:
+        raise EcflowrunError('The alter operation needs a variable')
+    if operation == 'force' and state is None:
+        raise EcflowrunError('The force operation needs a state')
+
+    client = ecflow.Client(host, str(port))
+    start = time.time()
+    client.sync_local()
+    defs = client.get_defs()
+    paths = resolve_nodes(defs, patterns) if defs is not None else []
+    resolved = time.time()
+
+    done = 0
+    batches = 0
+    if not dry_run:
+        for batch in _batches(paths, batch_size):
+            _apply(client, operation, batch, variable, state)
+            done += len(batch)
+            batches += 1
+            if progress is not None:
+                progress(done, len(paths))
+    end = time.time()
+
+    return {
+        'operation': operation,
+        'nodes': len(paths),
+        'paths': paths,
+        'batches': batches,
+        'dry_run': dry_run,
+        'resolve_s': resolved - start,
+        'apply_s': end - resolved,
+        'total_s': end - start,
+    }
+
+
+def format_summary(summary):
+    lines = [
+        '{0} of {1} nodes{2}'.format(
+            summary['operation'],
+            summary['nodes'],
+            ' (dry run)' if summary['dry_run'] else ''
+        ),
+        '  batches:  {}'.format(summary['batches']),
+        '  resolve:  {:.2f}s'.format(summary['resolve_s']),
+        '  apply:    {:.2f}s'.format(summary['apply_s']),
+        '  total:    {:.2f}s'.format(summary['total_s']),
+    ]
+    if summary['dry_run']:
+        lines.extend('  ' + path for path in summary['paths'])
+    return '\n'.join(lines)
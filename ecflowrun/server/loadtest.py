@@ -0,0 +1,173 @@
+"""
+Load test of an Ecflow server, simulating many jobs running at the same
+time, each going through an EcflowContextManager.
+"""
+import os
+import time
+import shutil
+import tempfile
+import multiprocessing
+
+from ecflowrun.errors import EcflowrunError
+from ecflowrun.context.manager import EcflowContextManager
+from ecflowrun.server.standin import StandinServer
+
+
+def parse_mix(mix):
+    """
+    Parse the number of child commands sent by each simulated job,
+    given as ``event=5,label=5,meter=20``.
+    """
+    counts = {'event': 0, 'label': 0, 'meter': 0}
+    for item in mix.split(','):
+        if not item:
+            continue
+        cmd, _, count = item.partition('=')
+        if cmd not in counts:
+            raise EcflowrunError('Unknown child command {}'.format(cmd))
+        counts[cmd] = int(count)
+    return counts
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[int(round(p / 100.0 * (len(samples) - 1)))]
+
+
+def _simulate_job(job):
+    """
+    Runs a single simulated job, returning the latency of each child
+    command it sent and whether it failed.
+    """
+    env, mix = job
+    latencies = []
+
+    def timed(cmd, func, *args):
+        start = time.time()
+        func(*args)
+        latencies.append((cmd, time.time() - start))
+
+    ctx = EcflowContextManager(handle_signals=False, **env)
+    try:
+        with ctx:
+            for i in range(mix['event']):
+                timed('event', ctx.event, 'e{}'.format(i))
+            for i in range(mix['label']):
+                timed('label', ctx.label, 'l', 'message {}'.format(i))
+            for i in range(mix['meter']):
+                timed('meter', ctx.meter, 'm', i)
+    except EcflowrunError:
+        failed = True
+    else:
+        failed = False
+    for phase in ('init', 'complete', 'abort'):
+        if phase in ctx.metrics.phases:
+            latencies.append((phase, ctx.metrics.phases[phase]['wall']))
+    return latencies, failed
+
+
+def run_loadtest(jobs, concurrency, mix, host, port, task='/loadtest/t{}',
+                 password='FREE', standin=False, latency=0.0):
+    """
+    Run ``jobs`` simulated jobs, at most ``concurrency`` at the same
+    time, against the server at host and port or, with ``standin``,
+    against a local server stand-in replying after ``latency`` seconds.
+    Each job sends the number of events, labels and meters given in
+    ``mix``, between its init and complete.
+
+    The simulated jobs are named after the ``task`` pattern, formatted
+    with the number of the job, and must exist on the server.
+    """
+    transport = None
+    server = None
+    work_dir = None
+    if standin:
+        work_dir = tempfile.mkdtemp(prefix='ecflowrun-loadtest')
+        socket_path = os.path.join(work_dir, 'standin.sock')
+        os.environ['ECFLOWRUN_RELAY_SOCKET'] = socket_path
+        server = StandinServer(socket_path, latency).start()
+        transport = 'relay'
+
+    env_jobs = []
+    for i in range(jobs):
+        env = {
+            'ECF_NAME': task.format(i),
+            'ECF_PASS': password,
+            'ECF_NODE': host,
+            'ECF_PORT': str(port),
+            'ECF_TRYNO': '1',
+            'LOGGER': 'loadtest',
+            'transport': transport,
+        }
+        env_jobs.append((env, mix))
+
+    pool = multiprocessing.Pool(concurrency)
+    start = time.time()
+    try:
+        results = pool.map(_simulate_job, env_jobs, chunksize=1)
+        elapsed = time.time() - start
+    finally:
+        pool.terminate()
+        pool.join()
+        if server is not None:
+            server.stop()
+            shutil.rmtree(work_dir)
+
+    latencies = {}
+    failures = 0
+    for job_latencies, failed in results:
+        failures += failed
+        for cmd, seconds in job_latencies:
+            latencies.setdefault(cmd, []).append(seconds)
+
+    report = {
+        'jobs': jobs,
+        'concurrency': concurrency,
+        'failed_jobs': failures,
+        'elapsed': elapsed,
+        'commands': sum(len(v) for v in latencies.values()),
+        'latency': {},
+    }
+    report['commands_per_second'] = report['commands'] / elapsed
+    if server is not None:
+        report['server_commands'] = server.total
+        report['server_commands_per_second'] = server.total / elapsed
+    for cmd, samples in latencies.items():
+        report['latency'][cmd] = {
+            'count': len(samples),
+            'p50_ms': percentile(samples, 50) * 1000,
+            'p90_ms': percentile(samples, 90) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000,
+            'max_ms': max(samples) * 1000,
+        }
+    return report
+
+
+def format_report(report):
+    lines = [
+        'Jobs: {0} ({1} failed), concurrency: {2}'.format(
+            report['jobs'], report['failed_jobs'], report['concurrency']
+        ),
+        'Elapsed: {0:.3f}s, {1} commands, {2:.1f} commands/s'.format(
+            report['elapsed'], report['commands'], report['commands_per_second']
+        ),
+    ]
+    if 'server_commands' in report:
+        lines.append(
+            'Server: {0} commands received, {1:.1f} commands/s'.format(
+                report['server_commands'], report['server_commands_per_second']
+            )
+        )
+    lines.append(
+        '{0:<10} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10}'.format(
+            'command', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms'
+        )
+    )
+    for cmd, stats in sorted(report['latency'].items()):
+        lines.append(
+            '{0:<10} {1:>8} {2:>10.3f} {3:>10.3f} {4:>10.3f} {5:>10.3f}'.format(
+                cmd, stats['count'], stats['p50_ms'], stats['p90_ms'],
+                stats['p99_ms'], stats['max_ms']
+            )
+        )
+    return '\n'.join(lines)
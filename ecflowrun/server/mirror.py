@@ -0,0 +1,160 @@
+"""
+Local mirror of the state of the suites of a server, kept up to date
+incrementally, so that the state of the nodes can be queried without
+loading the server.
+"""
+import os
+import json
+import time
+import logging
+import tempfile
+from collections import Counter
+
+from ecflowrun.errors import EcflowrunError
+from ecflowrun.context.transport import ecflow
+
+
+def _node_state(node):
+    return {
+        'state': str(node.get_state()),
+        'meters': dict((m.name(), m.value()) for m in node.meters),
+        'labels': dict(
+            (l.name(), l.new_value() or l.value()) for l in node.labels
+        ),
+        'events': dict(
+            (e.name_or_number(), e.value()) for e in node.events
+        ),
+    }
+
+
+def load_snapshot(path):
+    """
+    Read a snapshot written by SuiteMirror.snapshot, returning the
+    mapping from node path to its state, meters, labels and events.
+    """
+    with open(path) as fp:
+        return json.load(fp)['nodes']
+
+
+class SuiteMirror(object):
+    """
+    Mirror of the suites of a server. The first sync fetches the whole
+    definition, and the following ones only ask the server for what
+    changed since, through the change numbers kept by the client. Only
+    the nodes the server reports as changed are updated in the mirror,
+    unless the whole definition changed.
+
+    The ``index`` maps the path of every node to its state, meters,
+    labels and events. If ``suites`` is given, only those suites are
+    mirrored.
+    """
+    def __init__(self, host, port, suites=None):
+        if ecflow is None:
+            raise EcflowrunError('The ecflow module is not available')
+        self._client = ecflow.Client(host, str(port))
+        if suites:
+            self._client.ch_register(False, list(suites))
+        self.index = {}
+        self.last_sync = None
+        self.logger = logging.getLogger(__name__)
+        self._stale = True
+
+    def sync(self):
+        """
+        Bring the mirror up to date, returning true if anything changed.
+        """
+        self._client.sync_local()
+        self.last_sync = time.time()
+        if self._stale:
+            self._rebuild()
+            self._stale = False
+            return True
+        if not self._client.in_sync():
+            return False
+        # An empty list means that the whole definition changed
+        paths = list(self._client.changed_node_paths)
+        if not paths or '/' in paths:
+            self._rebuild()
+        else:
+            self._update(paths)
+        return True
+
+    def _add(self, index, node):
+        index[node.get_abs_node_path()] = _node_state(node)
+        if isinstance(node, (ecflow.Suite, ecflow.Family)):
+            for child in node.get_all_nodes():
+                index[child.get_abs_node_path()] = _node_state(child)
+
+    def _rebuild(self):
+        index = {}
+        defs = self._client.get_defs()
+        if defs is not None:
+            for suite in defs.suites:
+                self._add(index, suite)
+        self.index = index
+
+    def _update(self, paths):
+        """
+        Refresh the given nodes, and the ones below them, dropping those
+        that no longer exist.
+        """
+        defs = self._client.get_defs()
+        if defs is None:
+            self.index = {}
+            return
+        done = []
+        for path in sorted(paths):
+            # Nodes below a refreshed node were refreshed with it
+            if any(path.startswith(d + '/') for d in done):
+                continue
+            done.append(path)
+            node = defs.find_abs_node(path)
+            if node is None or isinstance(node, (ecflow.Suite, ecflow.Family)):
+                prefix = path + '/'
+                for p in [p for p in self.index if p.startswith(prefix)]:
+                    del self.index[p]
+            self.index.pop(path, None)
+            if node is not None:
+                self._add(self.index, node)
+
+    def get(self, path):
+        return self.index.get(path)
+
+    def state_counts(self):
+        return Counter(n['state'] for n in self.index.values())
+
+    def snapshot(self, path):
+        """
+        Write the mirror to a compact JSON file, replaced atomically so
+        that readers never see it half written.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.mirror')
+        with os.fdopen(fd, 'w') as fp:
+            json.dump(
+                {'time': self.last_sync, 'nodes': self.index},
+                fp,
+                separators=(',', ':')
+            )
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+
+    def watch(self, interval=10.0, snapshot_path=None, callback=None):
+        """
+        Keep the mirror up to date, syncing every ``interval`` seconds.
+        When something changes, the snapshot is rewritten, if a path is
+        given, and the callback is called with the mirror. Errors, such
+        as the server being unreachable, are logged and the sync is
+        retried on the next interval, fetching the whole definition.
+        """
+        while True:
+            try:
+                if self.sync():
+                    if snapshot_path is not None:
+                        self.snapshot(snapshot_path)
+                    if callback is not None:
+                        callback(self)
+            except Exception:
+                self.logger.exception('Failed to sync the mirror')
+                self._stale = True
+            time.sleep(interval)
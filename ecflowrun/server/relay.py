@@ -0,0 +1,110 @@
+"""
+Node-local relay that forwards the child commands of every job running
+on a host to the Ecflow servers, reusing a pool of clients instead of
+having each job start its own ecflow_client processes.
+
+The ecflow.Client opens a new connection to the server for every
+request, so the relay saves the process startups and the creation of
+the clients, but not the connections themselves.
+"""
+import os
+import json
+import logging
+import threading
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from ecflowrun.errors import EcflowrunError
+from ecflowrun.context.transport import ClientTransport, ecflow, make_socket_dir
+
+
+class ClientPool(object):
+    """
+    Pool of ecflow.Client instances, grouped by server host and port.
+    A client is only used by one request at a time. Clients do not keep
+    a connection open between requests.
+    """
+    def __init__(self, size=8):
+        self._size = size
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, port):
+        with self._lock:
+            idle = self._idle.setdefault((host, port), [])
+            if idle:
+                return idle.pop()
+        return ecflow.Client(str(host), str(port))
+
+    def release(self, host, port, client):
+        with self._lock:
+            idle = self._idle.setdefault((host, port), [])
+            if len(idle) < self._size:
+                idle.append(client)
+
+
+class RelayHandler(socketserver.StreamRequestHandler):
+    """
+    Handles a connection from a job. Each line received is a JSON
+    document with the job variables, the child command and its
+    arguments, which is answered with the output, error and return code
+    of the command.
+    """
+    def handle(self):
+        for line in iter(self.rfile.readline, b''):
+            request = json.loads(line.decode('utf-8'))
+            out, err, retcode = self.server.forward(
+                request['env'], request['cmd'], request['args']
+            )
+            reply = json.dumps({'out': out, 'err': err, 'retcode': retcode})
+            self.wfile.write((reply + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class RelayServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Relay server listening on a Unix socket, which only the user can
+    connect to.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, pool_size=8):
+        if ecflow is None:
+            raise EcflowrunError('The ecflow module is not available')
+        make_socket_dir(path)
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, RelayHandler)
+        os.chmod(path, 0o600)
+        self.pool = ClientPool(pool_size)
+        self.logger = logging.getLogger(__name__)
+
+    def forward(self, env, cmd, args):
+        """
+        Send a child command to the server on behalf of a job.
+        """
+        host, port = env['ECF_NODE'], env['ECF_PORT']
+        client = self.pool.acquire(host, port)
+        try:
+            return ClientTransport(env, client).send(cmd, *args)
+        except Exception as e:
+            self.logger.exception('Failed to forward {}'.format(cmd))
+            return '', str(e), 1
+        finally:
+            self.pool.release(host, port, client)
+
+
+def run_relay(path, pool_size=8):
+    """
+    Start the relay and serve requests until interrupted. The socket
+    file is removed when the relay stops.
+    """
+    server = RelayServer(path, pool_size)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
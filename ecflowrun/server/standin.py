@@ -0,0 +1,63 @@
+"""
+Stand-in for an Ecflow server, used to exercise ecflowrun without a
+real server. It speaks the same protocol as the node-local relay,
+acknowledging every child command it receives.
+"""
+import os
+import time
+import threading
+from collections import defaultdict
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from ecflowrun.server.relay import RelayHandler
+
+
+class StandinServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Server listening on a Unix socket that replies to every child
+    command as if it had been accepted by an Ecflow server, after
+    waiting ``latency`` seconds. The number of commands received is
+    kept by command type.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, latency=0.0):
+        if os.path.exists(path):
+            os.unlink(path)
+        socketserver.UnixStreamServer.__init__(self, path, RelayHandler)
+        self.path = path
+        self.latency = latency
+        self.counts = defaultdict(int)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def forward(self, env, cmd, args):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.counts[cmd] += 1
+        return '', '', 0
+
+    def start(self):
+        """
+        Serve requests on a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self._thread.join()
+        self.server_close()
+        os.unlink(self.path)
+
+    @property
+    def total(self):
+        with self._lock:
+            return sum(self.counts.values())
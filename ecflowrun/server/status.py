@@ -0,0 +1,117 @@
+"""
+Health probing of one or more Ecflow servers.
+"""
+import time
+import threading
+
+from ecflowrun.errors import EcflowrunError
+from ecflowrun.context.transport import ecflow
+
+
+def parse_servers(servers=None, servers_file=None):
+    """
+    Build the list of (host, port) to probe, from a comma separated
+    list of host:port and from a file with a host:port per line.
+    """
+    entries = []
+    if servers:
+        entries.extend(servers.split(','))
+    if servers_file:
+        with open(servers_file) as fp:
+            for line in fp:
+                line = line.split('#', 1)[0].strip()
+                if line:
+                    entries.append(line)
+    result = []
+    for entry in entries:
+        host, sep, port = entry.strip().rpartition(':')
+        if not sep or not host:
+            raise EcflowrunError('Invalid server {}, expected host:port'.format(entry))
+        result.append((host, port))
+    return result
+
+
+def _load_stats(client):
+    """
+    Return the request rates reported by the server statistics, if any.
+    """
+    try:
+        stats = client.stats(False)
+    except TypeError:
+        return None
+    if not stats:
+        return None
+    for line in stats.splitlines():
+        if "Request's per" in line:
+            return line.split(':', 1)[-1].strip()
+    return None
+
+
+def probe_server(host, port):
+    """
+    Ping a server, returning its latency, number of suites and load.
+    """
+    result = {'host': host, 'port': port, 'status': 'up'}
+    try:
+        client = ecflow.Client(host, str(port))
+        start = time.time()
+        client.ping()
+        result['latency_ms'] = (time.time() - start) * 1000
+        result['suites'] = len(client.suites())
+        result['load'] = _load_stats(client)
+    except RuntimeError as e:
+        result['status'] = 'down'
+        result['error'] = str(e).strip()
+    return result
+
+
+def probe_servers(servers, timeout=10.0):
+    """
+    Probe every server concurrently, giving up on the ones that do not
+    reply within ``timeout`` seconds.
+    """
+    results = [None] * len(servers)
+
+    def probe(idx, host, port):
+        results[idx] = probe_server(host, port)
+
+    threads = []
+    for idx, (host, port) in enumerate(servers):
+        t = threading.Thread(target=probe, args=(idx, host, port))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    deadline = time.time() + timeout
+    for idx, t in enumerate(threads):
+        t.join(max(0, deadline - time.time()))
+        if results[idx] is None:
+            host, port = servers[idx]
+            results[idx] = {
+                'host': host,
+                'port': port,
+                'status': 'timeout',
+                'error': 'No reply within {}s'.format(timeout),
+            }
+    return results
+
+
+def format_status(results):
+    lines = [
+        '{0:<30} {1:>6} {2:<8} {3:>10} {4:>7}  {5}'.format(
+            'host', 'port', 'status', 'ping ms', 'suites', 'load / error'
+        )
+    ]
+    for r in results:
+        latency = r.get('latency_ms')
+        lines.append(
+            '{0:<30} {1:>6} {2:<8} {3:>10} {4:>7}  {5}'.format(
+                r['host'],
+                r['port'],
+                r['status'],
+                '{:.1f}'.format(latency) if latency is not None else '-',
+                r.get('suites', '-'),
+                r.get('error') or r.get('load') or '-'
+            )
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,419 @@
+"""
+Daemon keeping warm worker processes, with the modules used by the jobs
+already imported, that run Python jobs on behalf of a launcher started
+by the job script. The output and exit code of the job are streamed
+back to the launcher, so that short jobs skip the interpreter startup
+and imports.
+"""
+import os
+import sys
+import json
+import errno
+import select
+import signal
+import socket
+import struct
+import logging
+import argparse
+import importlib
+import traceback
+
+from ecflowrun.errors import EcflowrunError
+from ecflowrun.context.transport import runtime_dir, make_socket_dir, is_own_socket
+
+
+# Every message between the launcher and the worker is a frame made of
+# its kind, the length of the payload and the payload
+FRAME_HEADER = struct.Struct('!cI')
+REQUEST = b'R'
+STDOUT = b'O'
+STDERR = b'E'
+SIGNAL = b'S'
+EXIT = b'X'
+
+# Message sent by a worker to the daemon when it takes a job
+BUSY = struct.Struct('!I')
+
+# Signals received by the launcher that are forwarded to the job
+FORWARDED_SIGNALS = (signal.SIGHUP, signal.SIGINT, signal.SIGTERM, signal.SIGUSR1, signal.SIGUSR2)
+
+
+def default_worker_socket():
+    """
+    Path of the socket of the worker daemon, which can be changed
+    through the ECFLOWRUN_WORKER_SOCKET variable.
+    """
+    return os.getenv(
+        'ECFLOWRUN_WORKER_SOCKET', os.path.join(runtime_dir(), 'worker.sock')
+    )
+
+
+def _send_frame(sock, kind, payload=b''):
+    sock.sendall(FRAME_HEADER.pack(kind, len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        try:
+            chunk = sock.recv(size - len(data))
+        except socket.error as e:
+            if e.errno == errno.EINTR:
+                continue
+            raise
+        if not chunk:
+            raise EOFError
+        data += chunk
+    return data
+
+
+def _recv_frame(sock):
+    kind, size = FRAME_HEADER.unpack(_recv_exact(sock, FRAME_HEADER.size))
+    return kind, _recv_exact(sock, size)
+
+
+def load_entry(entry):
+    """
+    Return the callable of an entry point given as module:function.
+    """
+    module, sep, name = entry.partition(':')
+    if not sep:
+        raise EcflowrunError('Invalid entry point {}, expected module:function'.format(entry))
+    obj = importlib.import_module(module)
+    for attr in name.split('.'):
+        obj = getattr(obj, attr)
+    return obj
+
+
+def run_entry(entry, argv=()):
+    """
+    Call an entry point with the given arguments, returning the exit
+    code of the job: the value returned, if an integer, or the code
+    of the SystemExit raised.
+    """
+    try:
+        result = load_entry(entry)(*argv)
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        sys.stderr.write('{}\n'.format(e.code))
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return result if isinstance(result, int) else 0
+
+
+def _run_job(conn, request):
+    """
+    Run a job in a new child process, sending its output to the launcher
+    as it arrives and forwarding to it the signals from the launcher.
+    Returns the exit code of the job.
+    """
+    out_r, out_w = os.pipe()
+    err_r, err_w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            conn.close()
+            os.close(out_r)
+            os.close(err_r)
+            os.dup2(out_w, 1)
+            os.dup2(err_w, 2)
+            os.close(out_w)
+            os.close(err_w)
+            devnull = os.open(os.devnull, os.O_RDONLY)
+            os.dup2(devnull, 0)
+            os.close(devnull)
+            for s in FORWARDED_SIGNALS:
+                signal.signal(s, signal.SIG_DFL)
+            os.environ.update(request['env'])
+            os.environ['ECFLOWRUN_LAUNCHER_PID'] = str(request['pid'])
+            if request.get('cwd'):
+                os.chdir(request['cwd'])
+            sys.argv = [request['entry']] + request['argv']
+            code = run_entry(request['entry'], request['argv'])
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(code)
+
+    os.close(out_w)
+    os.close(err_w)
+    streams = {out_r: STDOUT, err_r: STDERR}
+    launcher = conn
+    while streams:
+        watched = list(streams) + ([launcher] if launcher is not None else [])
+        try:
+            ready = select.select(watched, [], [])[0]
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        for fd in ready:
+            if fd is launcher:
+                try:
+                    kind, payload = _recv_frame(conn)
+                except (EOFError, socket.error):
+                    # The launcher is gone, and so is the job for Ecflow
+                    launcher = None
+                    os.kill(pid, signal.SIGTERM)
+                    continue
+                if kind == SIGNAL:
+                    os.kill(pid, int(payload))
+                continue
+            data = os.read(fd, 64 * 1024)
+            if not data:
+                os.close(fd)
+                del streams[fd]
+            elif launcher is not None:
+                try:
+                    _send_frame(conn, streams[fd], data)
+                except socket.error:
+                    launcher = None
+
+    status = os.waitpid(pid, 0)[1]
+    if os.WIFEXITED(status):
+        code = os.WEXITSTATUS(status)
+    else:
+        code = 128 + os.WTERMSIG(status)
+    if launcher is not None:
+        _send_frame(conn, EXIT, str(code).encode('ascii'))
+    return code
+
+
+class WorkerDaemon(object):
+    """
+    Daemon listening on a Unix socket, with ``workers`` processes forked
+    after importing the ``preload`` modules, waiting for jobs. Each
+    worker runs a single job, in a child process of its own. A worker
+    tells the daemon through a pipe as soon as it takes a job, and the
+    daemon forks a new one then, so that ``workers`` processes are
+    always waiting however long the jobs run.
+    """
+    def __init__(self, path, workers=4, preload=()):
+        self.path = path
+        self.workers = workers
+        self.preload = list(preload)
+        self.logger = logging.getLogger(__name__)
+        self._pids = set()
+        self._idle = set()
+        self._running = False
+        self._listener = None
+        self._busy_r = None
+        self._busy_w = None
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._work()
+            except Exception:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self._pids.add(pid)
+        self._idle.add(pid)
+
+    def _work(self):
+        for s in FORWARDED_SIGNALS:
+            signal.signal(s, signal.SIG_DFL)
+        os.close(self._busy_r)
+        conn = self._listener.accept()[0]
+        self._listener.close()
+        os.write(self._busy_w, BUSY.pack(os.getpid()))
+        os.close(self._busy_w)
+        # Busy workers are left to finish their job when the daemon stops
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        try:
+            kind, payload = _recv_frame(conn)
+            if kind == REQUEST:
+                _run_job(conn, json.loads(payload.decode('utf-8')))
+        finally:
+            conn.close()
+
+    def _stop(self, signum, frame):
+        self._running = False
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def _replace(self, pid):
+        """
+        Fork a new worker in place of one that is no longer waiting.
+        """
+        self._idle.discard(pid)
+        if self._running:
+            self._spawn()
+
+    def _read_busy(self):
+        data = os.read(self._busy_r, 4096 - 4096 % BUSY.size)
+        for offset in range(0, len(data), BUSY.size):
+            pid = BUSY.unpack(data[offset:offset + BUSY.size])[0]
+            if pid in self._idle:
+                self._replace(pid)
+
+    def _reap(self):
+        while self._pids:
+            try:
+                pid = os.waitpid(-1, os.WNOHANG)[0]
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if not pid:
+                break
+            self._pids.discard(pid)
+            # Workers that exit before taking a job are replaced too
+            if pid in self._idle:
+                self._replace(pid)
+
+    def serve_forever(self):
+        """
+        Serve jobs until the daemon is signalled to stop. The socket file,
+        only accessible by the user, is removed when the daemon stops.
+        """
+        for module in self.preload:
+            importlib.import_module(module)
+        make_socket_dir(self.path)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self._listener.listen(128)
+        self._running = True
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        self._busy_r, self._busy_w = os.pipe()
+        try:
+            for _ in range(self.workers):
+                self._spawn()
+            while self._pids:
+                # Wake up regularly to reap the workers that exited
+                try:
+                    ready = select.select([self._busy_r], [], [], 1.0)[0]
+                except select.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                if ready:
+                    self._read_busy()
+                self._reap()
+        finally:
+            self._listener.close()
+            os.close(self._busy_r)
+            os.close(self._busy_w)
+            os.unlink(self.path)
+
+
+def run_worker(path, workers=4, preload=()):
+    """
+    Start the worker daemon and serve jobs until it is stopped.
+    """
+    WorkerDaemon(path, workers, preload).serve_forever()
+
+
+def launch(entry, argv=(), env=None, path=None, fallback=True):
+    """
+    Run a job in a warm worker, streaming its output to the standard
+    output and error of this process, and return its exit code. The
+    signals received meanwhile are forwarded to the job.
+
+    The job is given the ``env`` variables, by default the ECF_*
+    variables of this process. If no worker daemon is listening on the
+    socket, or the socket is not owned by the user, the job is run in
+    this process instead, unless ``fallback`` is false.
+    """
+    if env is None:
+        env = dict((k, v) for k, v in os.environ.items() if k.startswith('ECF_'))
+    path = path or default_worker_socket()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        if not is_own_socket(path):
+            raise socket.error(errno.EPERM, 'Not a socket owned by the user')
+        sock.connect(path)
+    except socket.error as e:
+        sock.close()
+        if not fallback:
+            raise EcflowrunError('No worker daemon on {0}: {1}'.format(path, e))
+        logging.getLogger(__name__).warning(
+            'No worker daemon on {}, running the job locally'.format(path)
+        )
+        os.environ.update(env)
+        return run_entry(entry, list(argv))
+
+    request = {
+        'entry': entry,
+        'argv': list(argv),
+        'env': env,
+        'cwd': os.getcwd(),
+        'pid': os.getpid(),
+    }
+
+    def forward(signum, frame):
+        _send_frame(sock, SIGNAL, str(signum).encode('ascii'))
+
+    previous = {}
+    try:
+        _send_frame(sock, REQUEST, json.dumps(request).encode('utf-8'))
+        for s in FORWARDED_SIGNALS:
+            previous[s] = signal.signal(s, forward)
+        outputs = {
+            STDOUT: getattr(sys.stdout, 'buffer', sys.stdout),
+            STDERR: getattr(sys.stderr, 'buffer', sys.stderr),
+        }
+        while True:
+            try:
+                kind, payload = _recv_frame(sock)
+            except EOFError:
+                sys.stderr.write('Worker exited before the job ended\n')
+                return 1
+            if kind == EXIT:
+                return int(payload)
+            outputs[kind].write(payload)
+            outputs[kind].flush()
+    finally:
+        for s, handler in previous.items():
+            signal.signal(s, handler)
+        sock.close()
+
+
+def ecflow_launch():
+    """
+    Console entry point of the launcher, to be used from job scripts.
+    """
+    parser = argparse.ArgumentParser(
+        description='Run a Python job in a warm Ecflow worker'
+    )
+    parser.add_argument(
+        '-s',
+        '--socket',
+        help='Unix socket where the worker daemon listens',
+        default=None
+    )
+    parser.add_argument(
+        '--no-fallback',
+        help='Fail instead of running the job locally without a worker daemon',
+        action='store_true'
+    )
+    parser.add_argument(
+        'entry',
+        help='Entry point of the job, as module:function'
+    )
+    parser.add_argument(
+        'args',
+        help='Arguments passed to the entry point',
+        nargs=argparse.REMAINDER
+    )
+    args = parser.parse_args()
+    sys.exit(launch(
+        args.entry, args.args, path=args.socket, fallback=not args.no_fallback
+    ))
@@ -1 +1,3 @@
 from ecflowrun.tasks.bash_task import BashTask
+from ecflowrun.tasks.bash_pool import BashTaskPool
+from ecflowrun.tasks.dag import DagTask
@@ -0,0 +1,178 @@
+import os
+import logging
+import threading
+import multiprocessing
+
+from ecflowrun.context.manager import EcflowContextManager
+from ecflowrun.utils import TemporaryDirectory
+from ecflowrun.errors import EcflowrunError
+from ecflowrun.tasks.process import StreamingProcess, log_sink
+
+
+class BashTaskPool(object):
+    """
+    Runs a list of Bash commands concurrently as a single Ecflow job,
+    with at most ``workers`` commands running at the same time.
+
+    Each command can run for at most ``timeout`` seconds before being
+    killed. With ``fail_fast``, the first failed command stops the
+    pool, killing the commands still running, which are reported as
+    cancelled. Otherwise, every command is run and all failures are
+    reported at the end. A command that cannot be started counts as
+    failed. If ``meter`` is given, that Ecflow meter is set to the
+    number of commands finished, never going backwards, and failures to
+    update it are only logged.
+    """
+    def __init__(self, bash_cmds, env, workers=None, timeout=None,
+                 fail_fast=True, meter=None, tail_lines=20):
+        self.__bash_cmds = list(bash_cmds)
+        self.__env = env
+        self.__workers = workers or multiprocessing.cpu_count()
+        self.__timeout = timeout
+        self.__fail_fast = fail_fast
+        self.__meter = meter
+        self.__tail_lines = tail_lines
+
+        self.__lock = threading.Lock()
+        self.__stop = threading.Event()
+        self.__pending = []
+        self.__running = {}
+        self.__failures = []
+        self.__cancelled = set()
+        self.__finished = 0
+        self.__meter_lock = threading.Lock()
+        self.__meter_sent = 0
+
+    def __next(self):
+        with self.__lock:
+            if self.__stop.is_set() or not self.__pending:
+                return None
+            return self.__pending.pop(0)
+
+    def __run(self, ctx, tmp_dir, idx):
+        script_path = os.path.join(tmp_dir, 'script_{}'.format(idx))
+        with open(script_path, 'w') as fp:
+            fp.write(self.__bash_cmds[idx])
+
+        prefix = '[{}] '.format(idx)
+        sp = StreamingProcess(
+            ['/bin/bash', script_path],
+            log_sink(ctx, logging.INFO, prefix),
+            log_sink(ctx, logging.WARNING, prefix),
+            self.__tail_lines,
+            new_group=True,
+            env=ctx.environ()
+        )
+        with self.__lock:
+            if self.__stop.is_set():
+                return
+            sp.start()
+            self.__running[idx] = sp
+        ctx.add_child(sp)
+
+        timed_out = []
+
+        def expire():
+            timed_out.append(True)
+            sp.kill()
+
+        timer = None
+        if self.__timeout is not None:
+            timer = threading.Timer(self.__timeout, expire)
+            timer.start()
+        try:
+            retcode = sp.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+            ctx.remove_child(sp)
+
+        reason = None
+        if timed_out:
+            reason = 'timed out'
+        elif retcode:
+            reason = 'return code {}'.format(retcode)
+        self.__finish(ctx, idx, reason, sp.tail)
+
+    def __finish(self, ctx, idx, reason, tail):
+        """
+        Record a finished command, failed if a reason is given, and
+        update the meter.
+        """
+        with self.__lock:
+            self.__running.pop(idx, None)
+            self.__finished += 1
+            finished = self.__finished
+            if reason is not None and idx not in self.__cancelled:
+                self.__failures.append((idx, reason, tail))
+                if self.__fail_fast and not self.__stop.is_set():
+                    self.__stop.set()
+                    for other, running in self.__running.items():
+                        self.__cancelled.add(other)
+                        running.kill()
+        if self.__meter is not None:
+            # Commands finishing at the same time may get here in any
+            # order, so only a higher value is sent
+            with self.__meter_lock:
+                if finished <= self.__meter_sent:
+                    return
+                self.__meter_sent = finished
+                try:
+                    ctx.meter(self.__meter, finished)
+                except EcflowrunError as e:
+                    ctx.log('Failed to update meter: {}'.format(e), logging.WARNING)
+
+    def __work(self, ctx, tmp_dir):
+        idx = self.__next()
+        while idx is not None:
+            try:
+                self.__run(ctx, tmp_dir, idx)
+            except Exception as e:
+                ctx.log(
+                    'Command {0} could not be run: {1}'.format(idx, e),
+                    logging.ERROR
+                )
+                self.__finish(ctx, idx, 'error: {}'.format(e), [])
+            idx = self.__next()
+
+    def __report(self):
+        msgs = []
+        for idx, reason, tail in sorted(self.__failures):
+            msgs.append(
+                'Command {0} failed with {1}: {2}\n'
+                'Last lines of output:\n{3}'.format(
+                    idx, reason, self.__bash_cmds[idx], '\n'.join(tail)
+                )
+            )
+        for idx in sorted(self.__cancelled):
+            msgs.append('Command {0} cancelled: {1}'.format(idx, self.__bash_cmds[idx]))
+        return 'Failed to execute BashTaskPool\n{}'.format('\n'.join(msgs))
+
+    def execute(self):
+        with EcflowContextManager(**self.__env) as ctx:
+            ctx.log(
+                'Running bash task pool with {0} commands and {1} workers'.format(
+                    len(self.__bash_cmds), self.__workers
+                ),
+                logging.INFO
+            )
+            self.__pending = list(range(len(self.__bash_cmds)))
+            with TemporaryDirectory() as tmp:
+                threads = []
+                for _ in range(min(self.__workers, len(self.__bash_cmds))):
+                    t = threading.Thread(target=self.__work, args=(ctx, tmp.path))
+                    t.daemon = True
+                    t.start()
+                    threads.append(t)
+                for t in threads:
+                    t.join()
+
+                if self.__failures:
+                    raise EcflowrunError(self.__report())
+                if self.__finished != len(self.__bash_cmds):
+                    raise EcflowrunError(
+                        'Failed to execute BashTaskPool: only {0} of {1} '
+                        'commands finished'.format(
+                            self.__finished, len(self.__bash_cmds)
+                        )
+                    )
@@ -1,17 +1,63 @@
 import os
 import logging
-import subprocess
-import shlex
 
 from ecflowrun.context.manager import EcflowContextManager
 from ecflowrun.utils import TemporaryDirectory
 from ecflowrun.errors import EcflowrunError
+from ecflowrun.tasks.process import StreamingProcess, log_sink, file_sink
+from ecflowrun.tasks.cache import ResultCache
+from ecflowrun.context.metrics import format_usage
 
 
 class BashTask(object):
-    def __init__(self, bash_cmd, env):
+    """
+    Runs a Bash script as an Ecflow job. The output of the script is
+    streamed line by line to the job log or, if given, to the ``stdout``
+    and ``stderr`` files. The last ``tail_lines`` lines of output are
+    reported in the error raised if the script fails.
+
+    With a ``cache_dir``, the ``outputs`` files of a successful run are
+    cached, keyed by the command, the ``inputs`` files contents and the
+    value of the ``cache_vars`` variables, taken from the task variables
+    or the environment. A later run with the same key restores the
+    outputs from the cache and completes without running the script.
+
+    The resource usage of the script, including the processes it
+    started, is logged once it ends.
+    """
+    def __init__(self, bash_cmd, env, stdout=None, stderr=None, tail_lines=100,
+                 cache_dir=None, inputs=(), outputs=(), cache_vars=()):
         self.__bash_cmd = bash_cmd
         self.__env = env
+        self.__stdout = stdout
+        self.__stderr = stderr
+        self.__tail_lines = tail_lines
+        self.__cache = ResultCache(cache_dir) if cache_dir else None
+        self.__inputs = list(inputs)
+        self.__outputs = list(outputs)
+        self.__cache_vars = list(cache_vars)
+
+    def __cache_key(self):
+        variables = {}
+        for name in self.__cache_vars:
+            variables[name] = self.__env.get(name, os.getenv(name, ''))
+        return self.__cache.key(self.__bash_cmd, variables, self.__inputs)
+
+    def __store_outputs(self, ctx, key):
+        try:
+            self.__cache.store(key, self.__outputs)
+        except (IOError, OSError) as e:
+            ctx.log(
+                'Failed to cache outputs of bash task: {}'.format(e),
+                logging.WARNING
+            )
+
+    def __open_sink(self, ctx, path, lvl, files):
+        if path is None:
+            return log_sink(ctx, lvl)
+        fp = open(path, 'ab')
+        files.append(fp)
+        return file_sink(fp)
 
     def execute(self):
         with EcflowContextManager(**self.__env) as ctx:
@@ -19,20 +65,52 @@ class BashTask(object):
                 'Running bash task with command {}'.format(self.__bash_cmd),
                 logging.INFO
             )
+            key = None
+            if self.__cache is not None:
+                key = self.__cache_key()
+                if self.__cache.restore(key, self.__outputs):
+                    ctx.log(
+                        'Restored outputs from cache entry {}'.format(key),
+                        logging.INFO
+                    )
+                    return
+                self.__cache.detach(self.__outputs)
             with TemporaryDirectory() as tmp:
                 tmp_file_path = os.path.join(tmp.path, 'temporary_script')
-                fp = open(tmp_file_path, 'w')
-                fp.write(self.__bash_cmd)
-                fp.flush()
-                sp = subprocess.Popen(
-                    shlex.split('/bin/bash {}'.format(tmp_file_path)),
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                )
-
-                out, err = sp.communicate()
-                retcode = sp.returncode
+                with open(tmp_file_path, 'w') as fp:
+                    fp.write(self.__bash_cmd)
+
+                files = []
+                try:
+                    sp = StreamingProcess(
+                        ['/bin/bash', tmp_file_path],
+                        self.__open_sink(ctx, self.__stdout, logging.INFO, files),
+                        self.__open_sink(ctx, self.__stderr, logging.WARNING, files),
+                        self.__tail_lines,
+                        new_group=True,
+                        env=ctx.environ()
+                    )
+                    ctx.add_child(sp.start())
+                    try:
+                        retcode = sp.wait()
+                    finally:
+                        ctx.remove_child(sp)
+                    if sp.usage is not None:
+                        ctx.log(
+                            'Bash script used {}'.format(format_usage(sp.usage)),
+                            logging.INFO
+                        )
+                finally:
+                    for f in files:
+                        f.close()
+
                 if retcode:
                     raise EcflowrunError(
-                        'Failed to execute BashTask with command {}'.format(self.__bash_cmd)
+                        'Failed to execute BashTask with command {0}\n'
+                        'Last lines of output:\n{1}'.format(
+                            self.__bash_cmd, '\n'.join(sp.tail)
+                        )
                     )
+
+            if key is not None:
+                self.__store_outputs(ctx, key)
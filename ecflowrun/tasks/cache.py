@@ -0,0 +1,178 @@
+"""
+Content addressed cache of the outputs produced by tasks.
+"""
+import os
+import json
+import errno
+import shutil
+import hashlib
+import tempfile
+
+from ecflowrun.errors import EcflowrunError
+
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def file_digest(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _link_or_copy(src, dst):
+    """
+    Hard link src to dst, copying it if a link is not possible, for
+    example across file systems.
+    """
+    dst_dir = os.path.dirname(os.path.abspath(dst))
+    if not os.path.isdir(dst_dir):
+        os.makedirs(dst_dir)
+    if os.path.lexists(dst):
+        os.unlink(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ResultCache(object):
+    """
+    Cache of the output files of tasks, stored under ``cache_dir`` and
+    keyed by a hash of everything that determines them: the command,
+    the value of selected variables and the contents of the input
+    files.
+
+    Outputs are stored and restored as hard links when possible, so
+    outputs restored from the cache must not be modified in place.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, cmd, variables=None, inputs=()):
+        """
+        Compute the cache key of a task. ``variables`` is a mapping with
+        the name and value of the variables the task depends on.
+        """
+        digest = hashlib.sha256()
+        digest.update(cmd.encode('utf-8'))
+        for name, value in sorted((variables or {}).items()):
+            digest.update('\0{0}={1}'.format(name, value).encode('utf-8'))
+        for path in inputs:
+            try:
+                input_digest = file_digest(path)
+            except IOError as e:
+                raise EcflowrunError(
+                    'Failed to read cache input {0}: {1}'.format(path, e)
+                )
+            digest.update('\0{0}:{1}'.format(path, input_digest).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def restore(self, key, outputs):
+        """
+        Restore the outputs recorded for a key to their paths. Returns
+        false, without changing anything, if there is no complete entry
+        with all the outputs. If the outputs cannot be restored, for
+        example with the disk full, the ones already restored are
+        removed and false is returned too, so that the task runs.
+        """
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, MANIFEST_FILE)) as fp:
+                manifest = json.load(fp)
+        except (IOError, ValueError):
+            return False
+        if sorted(manifest['outputs']) != sorted(outputs):
+            return False
+        restored = []
+        try:
+            for idx, path in enumerate(manifest['outputs']):
+                restored.append(path)
+                _link_or_copy(os.path.join(entry, str(idx)), path)
+        except (IOError, OSError):
+            for path in restored:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            return False
+        return True
+
+    def _linked_files(self, files):
+        """
+        Return the (st_dev, st_ino) pairs of the given ones that belong
+        to a file of a cache entry.
+        """
+        found = set()
+        for root, dirs, names in os.walk(self.cache_dir):
+            for name in names:
+                try:
+                    st = os.lstat(os.path.join(root, name))
+                except OSError:
+                    continue
+                if (st.st_dev, st.st_ino) in files:
+                    found.add((st.st_dev, st.st_ino))
+                    if found == files:
+                        return found
+        return found
+
+    def detach(self, outputs):
+        """
+        Remove the outputs that are hard links to a file of a cache
+        entry, so that a task writing them in place does not change the
+        cached copy. Outputs hard linked to anything else are left alone.
+        """
+        try:
+            cache_dev = os.stat(self.cache_dir).st_dev
+        except OSError:
+            return
+        linked = {}
+        for path in outputs:
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            # Hard links never cross file systems
+            if st.st_nlink > 1 and st.st_dev == cache_dev:
+                linked[path] = (st.st_dev, st.st_ino)
+        if not linked:
+            return
+        cached = self._linked_files(set(linked.values()))
+        for path, ident in linked.items():
+            if ident in cached:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def store(self, key, outputs):
+        """
+        Record the outputs of a task for a key. The entry is built aside
+        and moved in place at once, so that a partial entry is never
+        seen.
+        """
+        entry = self._entry(key)
+        parent = os.path.dirname(entry)
+        if not os.path.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        staging = tempfile.mkdtemp(prefix='.staging', dir=parent)
+        try:
+            for idx, path in enumerate(outputs):
+                _link_or_copy(path, os.path.join(staging, str(idx)))
+            with open(os.path.join(staging, MANIFEST_FILE), 'w') as fp:
+                json.dump({'outputs': list(outputs)}, fp)
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            os.rename(staging, entry)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
@@ -0,0 +1,220 @@
+import os
+import errno
+import signal
+import pickle
+import logging
+import traceback
+import multiprocessing
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from multiprocessing import SimpleQueue
+except ImportError:
+    from multiprocessing.queues import SimpleQueue
+
+from ecflowrun.context.manager import EcflowContextManager
+from ecflowrun.errors import EcflowrunError
+
+
+# Queue where the worker processes report the steps they start, set on
+# each worker when the pool starts it. Writes to a SimpleQueue are not
+# buffered, so the report is not lost if the worker dies right after
+_started = None
+
+
+def _init_worker(env, started):
+    """
+    Restore the default signal handlers on the worker processes, which
+    would otherwise inherit the ones of the EcflowContextManager and
+    abort the job when the pool is terminated, and set the variables of
+    the job in their environment.
+    """
+    global _started
+    for s in EcflowContextManager._TRAPPED_SIGNALS:
+        signal.signal(s, signal.SIG_DFL)
+    os.environ.update(env)
+    _started = started
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _run_step(name, func, args, kwargs):
+    """
+    Runs a step on a worker process, catching any error so that it can
+    be reported back to the parent process. The step is reported as
+    started by the worker first, so that the parent can notice if the
+    worker dies while running it.
+    """
+    if _started is not None:
+        _started.put((name, os.getpid()))
+    try:
+        return name, True, func(*args, **kwargs)
+    except Exception:
+        return name, False, traceback.format_exc()
+
+
+class DagTask(object):
+    """
+    Runs a set of Python steps with dependencies between them as a
+    single Ecflow job. Every step runs as soon as all the steps it
+    requires are finished, on a pool of ``workers`` processes, so
+    independent steps run in parallel.
+
+    When a step finishes, an Ecflow event is fired, named after the step
+    unless another event name is given, and if ``meter`` is given, that
+    Ecflow meter is set to the number of steps finished. The first step
+    that fails aborts the job, as does a step whose result cannot be
+    sent back or whose worker process dies.
+
+    As the steps run on other processes, their functions and arguments
+    must be picklable, for example functions defined at module level.
+    """
+    def __init__(self, env, workers=None, meter=None, events=True):
+        self.__env = env
+        self.__workers = workers or multiprocessing.cpu_count()
+        self.__meter = meter
+        self.__events = events
+        self.__steps = {}
+
+    def step(self, name, func, args=(), kwargs=None, requires=(), event=None):
+        """
+        Add a new step, that runs ``func`` after every step named in
+        ``requires`` is finished.
+        """
+        if name in self.__steps:
+            raise EcflowrunError('Duplicated step {}'.format(name))
+        try:
+            pickle.dumps((func, args, kwargs))
+        except Exception as e:
+            raise EcflowrunError(
+                'Step {0} cannot be sent to a worker: {1}'.format(name, e)
+            )
+        self.__steps[name] = {
+            'func': func,
+            'args': tuple(args),
+            'kwargs': kwargs or {},
+            'requires': set(requires),
+            'event': event or name,
+        }
+        return self
+
+    def __validate(self):
+        """
+        Check that every dependency exists and that there are no cycles.
+        """
+        for name, step in self.__steps.items():
+            missing = step['requires'] - set(self.__steps)
+            if missing:
+                raise EcflowrunError(
+                    'Step {0} requires unknown steps {1}'.format(
+                        name, ', '.join(sorted(missing))
+                    )
+                )
+        done = set()
+        remaining = set(self.__steps)
+        while remaining:
+            ready = set(
+                name for name in remaining
+                if self.__steps[name]['requires'] <= done
+            )
+            if not ready:
+                raise EcflowrunError(
+                    'Cyclic dependencies between steps {}'.format(
+                        ', '.join(sorted(remaining))
+                    )
+                )
+            done |= ready
+            remaining -= ready
+
+    def execute(self):
+        """
+        Run every step, returning a mapping with the result of each one.
+        """
+        self.__validate()
+        with EcflowContextManager(**self.__env) as ctx:
+            ctx.log(
+                'Running {0} steps with {1} workers'.format(
+                    len(self.__steps), self.__workers
+                ),
+                logging.INFO
+            )
+            started = SimpleQueue()
+            pool = multiprocessing.Pool(
+                self.__workers, _init_worker, (ctx.environ(), started)
+            )
+            try:
+                return self.__run(ctx, pool, started)
+            finally:
+                pool.terminate()
+                pool.join()
+
+    def __run(self, ctx, pool, started):
+        wake = queue.Queue()
+        pending = set(self.__steps)
+        results = {}
+        running = {}
+        pids = {}
+
+        while pending or running:
+            ready = [
+                name for name in sorted(pending)
+                if self.__steps[name]['requires'] <= set(results)
+            ]
+            for name in ready:
+                step = self.__steps[name]
+                ctx.log('Starting step {}'.format(name), logging.INFO)
+                running[name] = pool.apply_async(
+                    _run_step,
+                    (name, step['func'], step['args'], step['kwargs']),
+                    callback=wake.put
+                )
+                pending.remove(name)
+
+            # Block with a timeout so that the main thread can still
+            # handle signals on Python 2, and check the running steps
+            # even if no result arrives
+            try:
+                wake.get(True, 0.5)
+            except queue.Empty:
+                pass
+            while not started.empty():
+                name, pid = started.get()
+                pids[name] = pid
+
+            for name in sorted(running):
+                result = running[name]
+                if not result.ready():
+                    if name in pids and not _alive(pids[name]):
+                        raise EcflowrunError(
+                            'Worker process {0} died running step {1}'.format(
+                                pids[name], name
+                            )
+                        )
+                    continue
+                del running[name]
+                try:
+                    _, ok, value = result.get()
+                except Exception as e:
+                    ok, value = False, 'Result could not be returned: {}'.format(e)
+                if not ok:
+                    raise EcflowrunError(
+                        'Step {0} failed:\n{1}'.format(name, value)
+                    )
+                results[name] = value
+                ctx.log('Finished step {}'.format(name), logging.INFO)
+                if self.__events:
+                    ctx.event(self.__steps[name]['event'])
+                if self.__meter is not None:
+                    ctx.meter(self.__meter, len(results))
+
+        return results
@@ -0,0 +1,161 @@
+"""
+Helpers to run child processes while streaming their output.
+"""
+import os
+import sys
+import errno
+import signal
+import logging
+import threading
+import subprocess
+from collections import deque
+
+from ecflowrun.context.metrics import usage_fields
+
+
+# Longest line read at once from the output of a child process. Longer
+# lines are split, so that memory use is bounded even for output
+# without any newline.
+MAX_LINE_LENGTH = 64 * 1024
+
+
+def _decode(line):
+    if isinstance(line, bytes) and str is not bytes:
+        line = line.decode('utf-8', 'replace')
+    return line.rstrip('\r\n')
+
+
+def log_sink(ctx, lvl=logging.INFO, prefix=''):
+    """
+    Sink that logs each line through the context manager.
+    """
+    def sink(line):
+        ctx.log(prefix + _decode(line), lvl)
+    return sink
+
+
+def file_sink(fp):
+    """
+    Sink that writes each line to a file opened in binary mode.
+    """
+    def sink(line):
+        fp.write(line)
+        fp.flush()
+    return sink
+
+
+class StreamingProcess(object):
+    """
+    Runs a child process, forwarding its stdout and stderr line by line
+    to the given sinks as the output arrives, instead of holding it in
+    memory. Only the last ``tail_lines`` lines of output are kept, to
+    be reported if the process fails.
+
+    A sink is a callable that receives each line as read from the
+    process, including the line terminator.
+
+    With ``new_group``, the process is started in a new process group,
+    so that killing it also kills every process it started.
+
+    Once the process is waited for, ``usage`` holds its own resource
+    usage, as reported by wait4, or None if it could not be read.
+    """
+    def __init__(self, args, stdout_sink, stderr_sink, tail_lines=100,
+                 new_group=False, **kwargs):
+        self._args = args
+        self._sinks = (stdout_sink, stderr_sink)
+        self._new_group = new_group
+        self._kwargs = kwargs
+        if new_group:
+            if sys.version_info[0] >= 3:
+                self._kwargs['start_new_session'] = True
+            else:
+                # preexec_fn is not safe with other threads running,
+                # but Python 2 offers nothing else
+                self._kwargs['preexec_fn'] = os.setsid
+        self._tail = deque(maxlen=tail_lines)
+        self._readers = []
+        self.process = None
+        self.usage = None
+
+    def _read(self, pipe, sink):
+        for line in iter(lambda: pipe.readline(MAX_LINE_LENGTH), b''):
+            self._tail.append(_decode(line))
+            sink(line)
+        pipe.close()
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self._args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            **self._kwargs
+        )
+        pipes = (self.process.stdout, self.process.stderr)
+        for pipe, sink in zip(pipes, self._sinks):
+            reader = threading.Thread(target=self._read, args=(pipe, sink))
+            reader.daemon = True
+            reader.start()
+            self._readers.append(reader)
+        return self
+
+    def wait(self):
+        """
+        Wait for the process to finish and for all its output to be
+        forwarded, returning its return code.
+        """
+        retcode = self._wait4()
+        for reader in self._readers:
+            reader.join()
+        return retcode
+
+    def _wait4(self):
+        """
+        Reap the process with wait4, to read its own resource usage
+        rather than the one of every child of this process.
+        """
+        if self.process.returncode is None:
+            while True:
+                try:
+                    status, r = os.wait4(self.process.pid, 0)[1:]
+                except OSError as e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    if e.errno != errno.ECHILD:
+                        raise
+                    # Already reaped elsewhere, through poll
+                    break
+                self.usage = usage_fields(r)
+                if os.WIFSIGNALED(status):
+                    self.process.returncode = -os.WTERMSIG(status)
+                else:
+                    self.process.returncode = os.WEXITSTATUS(status)
+                break
+        return self.process.wait()
+
+    def send_signal(self, signum):
+        """
+        Send a signal to the process, or to its whole process group if
+        it was started in a new one.
+        """
+        try:
+            if self._new_group:
+                os.killpg(self.process.pid, signum)
+            else:
+                self.process.send_signal(signum)
+        except OSError:
+            pass
+
+    def kill(self):
+        """
+        Kill the process, or its whole process group if it was started
+        in a new one.
+        """
+        self.send_signal(signal.SIGKILL)
+
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def tail(self):
+        return list(self._tail)
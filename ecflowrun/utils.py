@@ -1,50 +1,51 @@
-import os
-import glob
-import tempfile
-import shutil
+import time
+import atexit
+import socket
+import logging
 import traceback
+import threading
 import smtplib
+from collections import OrderedDict
 from email.mime.text import MIMEText
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ecflowrun.workspace import WorkspaceManager
+
 
 class TemporaryDirectory(object):
     """
     This class rprovides a context where it is available a temporary
     directory that can be used as a working directory for a task or
     a group of tasks.
+
+    The directories are managed by a WorkspaceManager, which can be
+    given to use another base directory or to limit the space used by
+    preserved directories. With ``preserve``, the most recently used
+    directory with the same prefix is reused and kept when the context
+    ends. Otherwise, a new directory is created and deleted in the
+    background when the context ends without errors.
     """
-    def __init__(self, preserve=False, prefix=''):
+    def __init__(self, preserve=False, prefix='', workspace=None):
         self.tmp_dir = None
         self.preserve = preserve
         self.prefix = prefix
+        self.workspace = workspace or WorkspaceManager()
 
     def __enter__(self):
-        if self.preserve:
-            self.tmp_dir = self.__get_existing()
-        else:
-            self.tmp_dir = self.__create_new()
+        self.tmp_dir = self.workspace.acquire(self.prefix, reuse=self.preserve)
         return self
 
     def __exit__(self, exc_type, exc_value, exc_tb):
-        if exc_type is None and self.tmp_dir is not None:
-            if not self.preserve:
-                shutil.rmtree(self.tmp_dir)
-
-    def __get_existing(self):
-        base_tmp = '/tmp'
-        tmp_contents = glob.glob(os.path.join(base_tmp, 'ecflow-{}*'.format(self.prefix)))
-        if len(tmp_contents) > 1:
-            tmp_contents_mtimes = [
-                (path, os.stat(path).st_mtime) for path in tmp_contents
-            ]
-            return max(tmp_contents_mtimes, key=lambda x: x[1])
-        elif len(tmp_contents) > 0:
-            return tmp_contents[0]
+        if self.tmp_dir is None:
+            return
+        if exc_type is None and not self.preserve:
+            self.workspace.discard(self.tmp_dir)
         else:
-            return self.__create_new()
-
-    def __create_new(self):
-        return tempfile.mkdtemp(prefix='ecflow-{}'.format(self.prefix))
+            self.workspace.release(self.tmp_dir, self.prefix)
 
     def clean(self):
         self.preserve = False
@@ -73,3 +74,145 @@ class EmailNotifier(object):
 
         s.sendmail(sender, dest, msg.as_string())
         s.quit()
+
+
+class QueuedEmailNotifier(object):
+    """
+    Email notifier that sends the messages from a background thread,
+    so that sending never blocks the caller, reusing the same SMTP
+    connection while messages keep coming. The connection is closed
+    after ``idle_timeout`` seconds without messages.
+
+    With a ``digest_window``, the messages queued within that many
+    seconds of the first one are merged into a single digest email for
+    each sender and destination. Otherwise, every message is sent on its
+    own.
+
+    Every SMTP operation gives up after ``smtp_timeout`` seconds, so that
+    an unresponsive server cannot hold the messages, or the exit of the
+    process, forever.
+
+    TLS and login are only used when ``use_tls`` is set and a username
+    is given, respectively, so that a local SMTP server can be used for
+    testing.
+    """
+    _STOP = object()
+
+    def __init__(self, server, port, username=None, password=None,
+                 use_tls=True, digest_window=0, idle_timeout=60,
+                 smtp_timeout=30):
+        self.__server = server
+        self.__port = port
+        self.__username = username
+        self.__password = password
+        self.__use_tls = use_tls
+        self.__digest_window = digest_window
+        self.__idle_timeout = idle_timeout
+        self.__smtp_timeout = smtp_timeout
+        self.__smtp = None
+        self.__queue = queue.Queue()
+        self.__logger = logging.getLogger(__name__)
+        self.__thread = threading.Thread(target=self.__run)
+        self.__thread.daemon = True
+        self.__thread.start()
+        atexit.register(self.close)
+
+    def send_email(self, sender, dest, subject, msg):
+        """
+        Queue a message to be sent.
+        """
+        self.__queue.put((sender, dest, subject, msg))
+
+    def close(self, timeout=60):
+        """
+        Send the messages still queued and stop the background thread,
+        waiting at most ``timeout`` seconds for it.
+        """
+        if self.__thread.is_alive():
+            self.__queue.put(self._STOP)
+            self.__thread.join(timeout)
+            if self.__thread.is_alive():
+                self.__logger.warning(
+                    'Gave up waiting for the queued emails to be sent'
+                )
+
+    def __connect(self):
+        s = smtplib.SMTP(self.__server, self.__port, timeout=self.__smtp_timeout)
+        if self.__use_tls:
+            s.starttls()
+        if self.__username is not None:
+            s.login(self.__username, self.__password)
+        self.__smtp = s
+
+    def __disconnect(self):
+        if self.__smtp is not None:
+            try:
+                self.__smtp.quit()
+            except (smtplib.SMTPException, socket.error):
+                pass
+            self.__smtp = None
+
+    def __send(self, sender, dest, subject, body):
+        msg = MIMEText(body)
+        msg['From'] = sender
+        msg['To'] = dest
+        msg['Subject'] = subject
+        for attempt in range(2):
+            try:
+                if self.__smtp is None:
+                    self.__connect()
+                self.__smtp.sendmail(sender, dest, msg.as_string())
+                return
+            except (smtplib.SMTPServerDisconnected, socket.error):
+                # The server may have dropped the connection while idle,
+                # so try once more with a new one
+                self.__smtp = None
+            except smtplib.SMTPException:
+                break
+        self.__logger.error(
+            'Failed to send email to {0}: {1}'.format(dest, traceback.format_exc())
+        )
+
+    def __send_batch(self, batch):
+        groups = OrderedDict()
+        for sender, dest, subject, body in batch:
+            groups.setdefault((sender, dest), []).append((subject, body))
+        for (sender, dest), messages in groups.items():
+            if len(messages) == 1:
+                subject, body = messages[0]
+            else:
+                subject = '[{0} notifications] {1}'.format(
+                    len(messages), messages[0][0]
+                )
+                body = '\n\n'.join(
+                    '{0}\n{1}\n{2}'.format(s, '-' * len(s), b) for s, b in messages
+                )
+            self.__send(sender, dest, subject, body)
+
+    def __run(self):
+        stop = False
+        while not stop:
+            try:
+                item = self.__queue.get(True, self.__idle_timeout)
+            except queue.Empty:
+                self.__disconnect()
+                continue
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = time.time() + self.__digest_window
+            while self.__digest_window > 0:
+                remaining = deadline - time.time()
+                try:
+                    if remaining > 0:
+                        item = self.__queue.get(True, remaining)
+                    else:
+                        item = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self.__send_batch(batch)
+        self.__disconnect()
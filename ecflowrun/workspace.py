@@ -0,0 +1,254 @@
+"""
+Management of the working directories used by the jobs.
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import errno
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from ecflowrun.errors import EcflowrunError
+
+
+# Files kept on the base directory, one set per user, as the base
+# directory may be shared
+INDEX_FILE = '.ecflowrun-index-{}.json'
+LOCK_FILE = '.ecflowrun-index-{}.lock'
+TRASH_DIR = '.ecflowrun-trash-{}'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _open_own(path, flags):
+    """
+    Open a file of the base directory, which must be owned by the user
+    and not writable by anyone else, as the base directory may be shared.
+    """
+    fd = os.open(path, flags | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    st = os.fstat(fd)
+    if st.st_uid != os.getuid() or st.st_mode & 0o022:
+        os.close(fd)
+        raise EcflowrunError(
+            'Refusing to use {}, not owned by the user or writable by others'.format(path)
+        )
+    return fd
+
+
+def _dir_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+class WorkspaceManager(object):
+    """
+    Keeps the working directories of the jobs under ``base_dir``. The
+    directories that are kept for reuse are recorded in an index file,
+    by prefix, instead of scanning the base directory to find them.
+    Directories that are deleted when the job ends are never indexed,
+    so they cost no more than creating them.
+
+    Indexed directories that are no longer in use are evicted, least
+    recently used first, when older than ``max_age`` seconds or while
+    their total size is above ``max_size`` bytes. Their sizes are only
+    measured when evicting. Directories are deleted in the
+    background, after being moved to a trash directory, so that deleting
+    large trees never delays a job.
+
+    The base directory defaults to the ECFLOWRUN_WORKSPACE variable or,
+    if unset, to the system temporary directory. The index is only used
+    if owned by the user, and its entries only if they are directories
+    of the base directory, so that eviction never deletes anything else.
+    """
+    def __init__(self, base_dir=None, max_size=None, max_age=None):
+        self.base_dir = base_dir or os.getenv(
+            'ECFLOWRUN_WORKSPACE', tempfile.gettempdir()
+        )
+        self.max_size = max_size
+        self.max_age = max_age
+        uid = os.getuid()
+        self._index_path = os.path.join(self.base_dir, INDEX_FILE.format(uid))
+        self._lock_path = os.path.join(self.base_dir, LOCK_FILE.format(uid))
+        self._trash_dir = os.path.join(self.base_dir, TRASH_DIR.format(uid))
+        self._indexed = set()
+
+    @contextmanager
+    def _locked_index(self):
+        """
+        Lock the index against other processes, yielding its contents,
+        which are saved back when the block ends.
+        """
+        if not os.path.isdir(self.base_dir):
+            os.makedirs(self.base_dir)
+        fd = _open_own(self._lock_path, os.O_RDWR | os.O_CREAT)
+        with os.fdopen(fd, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = self._read_index()
+                yield index
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=self.base_dir, prefix=os.path.basename(self._index_path)
+                )
+                with os.fdopen(fd, 'w') as fp:
+                    json.dump(index, fp)
+                os.rename(tmp_path, self._index_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            fd = _open_own(self._index_path, os.O_RDONLY)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return {}
+        with os.fdopen(fd) as fp:
+            try:
+                index = json.load(fp)
+            except ValueError:
+                return {}
+        base_dir = os.path.realpath(self.base_dir)
+        for prefix, entries in index.items():
+            entries[:] = [
+                e for e in entries
+                if os.path.dirname(os.path.realpath(e['path'])) == base_dir and
+                os.path.basename(e['path']).startswith('ecflow-')
+            ]
+        return index
+
+    def _mkdtemp(self, prefix):
+        if not os.path.isdir(self.base_dir):
+            os.makedirs(self.base_dir)
+        return tempfile.mkdtemp(prefix='ecflow-{}'.format(prefix), dir=self.base_dir)
+
+    def acquire(self, prefix='', reuse=False):
+        """
+        Return the path of a working directory for the given prefix.
+        With ``reuse``, the most recently used directory with that
+        prefix is returned, if one exists, and the directory is indexed.
+        Otherwise, a new directory is created without touching the index.
+        """
+        if not reuse:
+            return self._mkdtemp(prefix)
+        with self._locked_index() as index:
+            entries = index.setdefault(prefix, [])
+            entries[:] = [e for e in entries if os.path.isdir(e['path'])]
+            if entries:
+                entry = max(entries, key=lambda e: e['used'])
+            else:
+                entry = {'path': self._mkdtemp(prefix)}
+                entries.append(entry)
+            entry['used'] = time.time()
+            entry['pid'] = os.getpid()
+            # The contents are about to change
+            entry['size'] = None
+            self._indexed.add(entry['path'])
+            return entry['path']
+
+    def release(self, path, prefix=''):
+        """
+        Mark a working directory as no longer in use, keeping it for
+        later reuse, and evict the directories over the limits. A
+        directory that was not indexed yet is indexed under ``prefix``.
+        """
+        with self._locked_index() as index:
+            found = [e for entries in index.values() for e in entries if e['path'] == path]
+            if not found:
+                found = [{'path': path}]
+                index.setdefault(prefix, []).extend(found)
+            for entry in found:
+                entry['used'] = time.time()
+                entry['size'] = None
+                entry['pid'] = None
+            evicted = self._evict(index)
+        self._indexed.discard(path)
+        for p in evicted:
+            self._delete(p)
+
+    def discard(self, path):
+        """
+        Remove a working directory from the index, if it was indexed,
+        and delete it.
+        """
+        if path in self._indexed:
+            with self._locked_index() as index:
+                for entries in index.values():
+                    entries[:] = [e for e in entries if e['path'] != path]
+            self._indexed.discard(path)
+        self._delete(path)
+
+    def evict(self):
+        """
+        Delete the directories over the age and size limits.
+        """
+        with self._locked_index() as index:
+            evicted = self._evict(index)
+        for p in evicted:
+            self._delete(p)
+
+    def _evict(self, index):
+        now = time.time()
+        idle = []
+        for prefix, entries in index.items():
+            for entry in entries:
+                if entry.get('pid') and _pid_alive(entry['pid']):
+                    continue
+                idle.append((entry['used'], prefix, entry))
+        idle.sort(key=lambda x: x[0])
+
+        if self.max_size is not None:
+            # Sizes are measured once per use of a directory, as it can
+            # only change while in use
+            for _, _, entry in idle:
+                if entry.get('size') is None:
+                    entry['size'] = _dir_size(entry['path'])
+        total = sum(e.get('size') or 0 for _, _, e in idle)
+        evicted = []
+        for used, prefix, entry in idle:
+            too_old = self.max_age is not None and now - used > self.max_age
+            too_big = self.max_size is not None and total > self.max_size
+            if not (too_old or too_big):
+                continue
+            index[prefix].remove(entry)
+            total -= entry.get('size') or 0
+            evicted.append(entry['path'])
+        return evicted
+
+    def _delete(self, path):
+        """
+        Move a directory to the trash and delete the trash contents on a
+        background thread.
+        """
+        if not os.path.isdir(self._trash_dir):
+            try:
+                os.makedirs(self._trash_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        try:
+            os.rename(path, os.path.join(self._trash_dir, uuid.uuid4().hex))
+        except OSError:
+            shutil.rmtree(path, ignore_errors=True)
+        # A non daemon thread, so that the deletion is not cut short
+        # when the job finishes
+        threading.Thread(target=self._empty_trash).start()
+
+    def _empty_trash(self):
+        for name in os.listdir(self._trash_dir):
+            shutil.rmtree(os.path.join(self._trash_dir, name), ignore_errors=True)
@@ -15,6 +15,7 @@ setup(
     entry_points={
         'console_scripts': [
             'ecflow_admin = ecflowrun.server.admin:ecflow_admin',
+            'ecflow_launch = ecflowrun.server.worker:ecflow_launch',
         ]
     },
 )